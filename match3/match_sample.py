@@ -183,6 +183,231 @@ class Gage:
         pyxel.rect(self.inside_x, self.inside_y, self.inside_width, self.inside_height, self.inside_col)
 
 
+class Board :
+    """盤面のロジック用データ。チップの種類とマッチ状態を1次元の配列で持つ (描画はChipが担当)"""
+    EMPTY = 0   # 空きマス (チップの種類は1から)
+    SENTINEL = 255   # 盤面の外側の番兵 (どの種類とも一致しない)
+    PAD = 3   # 番兵の幅。並びは2マス先まで見て、入れ替えの更新はさらに1マス先まで広がる
+
+    # 入れ替えの向きごとのmovesのビット (自分が受け取って揃う, 相手が受け取って揃う)
+    RIGHT_SELF = 1
+    RIGHT_OTHER = 2
+    DOWN_SELF = 4
+    DOWN_OTHER = 8
+    # movesの値から成立する入れ替えの数を引く表
+    MOVE_COUNT = bytes(((flags & 3) != 0) + ((flags & 12) != 0) for flags in range(16))
+
+    def __init__(self, width, height) :
+        self.width = width
+        self.height = height
+        self.stride = width + 2 * Board.PAD
+        self.origin = Board.PAD * self.stride + Board.PAD
+        length = self.stride * (height + 2 * Board.PAD)
+
+        # index = origin + y * stride + x、外側はSENTINEL
+        self.types = bytearray(bytes([Board.SENTINEL]) * length)
+        self.matched = bytearray(length)
+
+        # 盤面内のindex (乱数を引く順番に合わせて列ごとに並べる)
+        self.cells = tuple(self.index(x, y) for x in range(width) for y in range(height))
+        for i in self.cells :
+            self.types[i] = Board.EMPTY
+
+        # 前回のcheck_matchから変化した行と列 (変化していない行と列には新しいマッチはない)
+        self.dirty_rows = bytearray(height)
+        self.dirty_cols = bytearray(width)
+
+        # 成立する入れ替え。moves[i]は(i, i+1)と(i, i+stride)の入れ替えのビット
+        self.moves = bytearray(length)
+        self.move_count = 0
+        self.pending = bytearray(length)   # movesを調べ直すマス
+
+        s = self.stride
+        lines = ((-2, -1), (-1, 1), (1, 2), (-2*s, -s), (-s, s), (s, 2*s))
+        # 隣(offset)からチップを受け取ったときに揃うか調べる並び (受け取り元を含む並びは除く)
+        self.receive_lines = {offset : tuple(line for line in lines if offset not in line) for offset in (1, -1, s, -s)}
+        # マスが変わったときにmovesを調べ直すマスの相対位置
+        # (そのマスを並びに含む受け取り側のマスと、その受け取り側を含む入れ替えのキー)
+        cross = (0, -2, -1, 1, 2, -2*s, -s, s, 2*s)
+        self.affected = tuple(sorted({c + key for c in cross for key in (0, -1, -s)}))
+
+    def index(self, x, y) :
+        return self.origin + y * self.stride + x
+
+    def xy(self, i) :
+        i -= self.origin
+        return (i % self.stride, i // self.stride)
+
+    def touch(self, i) :
+        """マスの変化を記録して、次のcheck_matchでその行と列を、次のupdate_movesで周りの入れ替えを調べ直す"""
+        x, y = self.xy(i)
+        self.dirty_rows[y] = 1
+        self.dirty_cols[x] = 1
+
+        pending = self.pending
+        for offset in self.affected :
+            pending[i + offset] = 1
+
+    def touch_all(self) :
+        self.dirty_rows[:] = b'\x01' * self.height
+        self.dirty_cols[:] = b'\x01' * self.width
+        for i in self.cells :
+            self.pending[i] = 1
+
+    def swap(self, a, b) :
+        types = self.types
+        types[a], types[b] = types[b], types[a]
+        self.touch(a)
+        self.touch(b)
+
+    def randomize(self, max_type) :
+        for i in self.cells :
+            self.types[i] = pyxel.rndi(1, max_type)
+            self.matched[i] = 0
+        self.touch_all()
+
+    def check_match(self) :
+        """
+        変化した行と列だけを調べ、3つ以上並んだマスにマッチの印を付ける。
+        マッチしたグループ (並んだマスのindexのrange) のリストを返す。L字やT字は横と縦の2グループになる
+        """
+        groups = []
+
+        # 横チェック
+        for y in range(self.height) :
+            if self.dirty_rows[y] :
+                self.dirty_rows[y] = 0
+                start = self.index(0, y)
+                self._find_runs(start, start + self.width, 1, groups)
+
+        # 縦チェック
+        for x in range(self.width) :
+            if self.dirty_cols[x] :
+                self.dirty_cols[x] = 0
+                start = self.index(x, 0)
+                self._find_runs(start, start + self.height * self.stride, self.stride, groups)
+
+        return groups
+
+    def _find_runs(self, start, stop, step, groups) :
+        """1行(1列)の中で同じ種類が3つ以上続く並びを探す"""
+        types = self.types
+        matched = self.matched
+        last = stop - 2 * step
+        i = start
+        while i < last :
+            t = types[i]
+            j = i + step
+            while j < stop and types[j] == t :
+                j += step
+            if t and j - i >= 3 * step :
+                run = range(i, j, step)
+                for k in run :
+                    matched[k] = 1
+                groups.append(run)
+            i = j
+
+    def delete(self) :
+        """マッチしたマスを空きにして、そのindexのリストを返す"""
+        types = self.types
+        matched = self.matched
+        deleted = []
+        for i in self.cells :
+            if matched[i] :
+                types[i] = Board.EMPTY
+                matched[i] = 0
+                deleted.append(i)
+        return deleted
+
+    def drop(self) :
+        """空きマスを詰めて、移動したチップの(移動元, 移動先)のリストを返す"""
+        types = self.types
+        stride = self.stride
+        moves = []
+        for x in range(self.width) :
+            top = self.index(x, 0)
+            dst = self.index(x, self.height - 1)
+            for src in range(dst, top - 1, -stride) :   # 下から上に処理
+                t = types[src]
+                if t :
+                    if src != dst :
+                        types[dst] = t
+                        types[src] = Board.EMPTY
+                        self.touch(src)
+                        self.touch(dst)
+                        moves.append((src, dst))
+                    dst -= stride
+        return moves
+
+    def refill(self, max_type) :
+        """空きマスに新しいチップを置いて、置いたindexのリストを返す"""
+        types = self.types
+        filled = []
+        for i in self.cells :
+            if not types[i] :
+                types[i] = pyxel.rndi(1, max_type)
+                self.touch(i)
+                filled.append(i)
+        return filled
+
+    def update_moves(self) :
+        """変化したマスの周りだけ入れ替えを調べ直し、成立する入れ替えの数を返す"""
+        types = self.types
+        moves = self.moves
+        pending = self.pending
+        count = Board.MOVE_COUNT
+        stride = self.stride
+        for i in self.cells :
+            if not pending[i] :
+                continue
+            pending[i] = 0
+
+            flags = 0
+            t = types[i]
+            if Board.EMPTY < t < Board.SENTINEL :
+                right = types[i+1]
+                if Board.EMPTY < right < Board.SENTINEL and right != t :
+                    if self._receives(i, right, 1) :
+                        flags |= Board.RIGHT_SELF
+                    if self._receives(i+1, t, -1) :
+                        flags |= Board.RIGHT_OTHER
+                down = types[i+stride]
+                if Board.EMPTY < down < Board.SENTINEL and down != t :
+                    if self._receives(i, down, stride) :
+                        flags |= Board.DOWN_SELF
+                    if self._receives(i+stride, t, -stride) :
+                        flags |= Board.DOWN_OTHER
+
+            self.move_count += count[flags] - count[moves[i]]
+            moves[i] = flags
+        return self.move_count
+
+    def _receives(self, i, t, offset) :
+        """マスiが隣(offset)から種類tのチップを受け取ったときに3つ並ぶか"""
+        types = self.types
+        for a, b in self.receive_lines[offset] :
+            if types[i+a] == t and types[i+b] == t :
+                return True
+        return False
+
+    def valid_moves(self) :
+        """成立する入れ替えの(index, index)のリストを返す (update_movesの後に呼ぶ)"""
+        result = []
+        for i in self.cells :
+            flags = self.moves[i]
+            if flags & (Board.RIGHT_SELF | Board.RIGHT_OTHER) :
+                result.append((i, i+1))
+            if flags & (Board.DOWN_SELF | Board.DOWN_OTHER) :
+                result.append((i, i+self.stride))
+        return result
+
+    def is_tenpai(self, i) :
+        """マスiに隣のチップを入れると揃うか (update_movesの後に呼ぶ)"""
+        moves = self.moves
+        return bool(moves[i] & (Board.RIGHT_SELF | Board.DOWN_SELF) or
+                    moves[i-1] & Board.RIGHT_OTHER or
+                    moves[i-self.stride] & Board.DOWN_OTHER)
+
 class App:
     TITLE = "Match3"
 
@@ -217,11 +442,13 @@ class App:
 
         self.score=0
         self.combo=0
+        self.match_groups = []
 
         self.game_timer_load = App.GAME_TIME * App.FPS
         self.game_timer_val = 0
 
         self.box = []
+        self.board = Board(App.BOX_WIDTH, App.BOX_HEIGHT)
         self.max_type = 6
         self.select = 0
 
@@ -263,11 +490,13 @@ class App:
 
     def init_box(self):
         while True :
-            self.box = [[Chip(self.x2posx(x), self.y2posy(y-1), pyxel.rndi(1, self.max_type), self.x2posx(x),self.y2posy(y)) for y in range(App.BOX_HEIGHT)] for x in range(App.BOX_WIDTH)]
+            self.board.randomize(self.max_type)
+
+            while self.board.check_match() :
+                self.board.delete()
+                self.board.refill(self.max_type)
 
-            while self.check_match() :
-                self.delete_chips()
-                self.refill_chips()
+            self.box = [[self.new_chip(x, y) for y in range(App.BOX_HEIGHT)] for x in range(App.BOX_WIDTH)]
 
             if self.check_tenpai_all() > 0:
                 break
@@ -328,8 +557,13 @@ class App:
         return pos_y
 
 
+    def new_chip(self, x, y) :
+        """盤面の種類で1マス上からChipを落とす"""
+        type = self.board.types[self.board.index(x, y)]
+        return Chip(self.x2posx(x), self.y2posy(y-1), type, self.x2posx(x), self.y2posy(y))
+
     def GetChipType(self, Position) :
-        return self.box[Position.x][Position.y].type
+        return self.board.types[self.board.index(Position.x, Position.y)]
 
     def SelectChip(self, Position) :
         self.drag = Position
@@ -358,6 +592,8 @@ class App:
 
             self.box[self.drag.x][self.drag.y].select = False
 
+        self.board.swap(self.board.index(self.drag.x, self.drag.y), self.board.index(self.drag2.x, self.drag2.y))
+
         tmp = self.get_drag_chip()
         self.box[self.drag.x][self.drag.y] = self.get_drag2_chip()
         self.box[self.drag2.x][self.drag2.y] = tmp
@@ -379,86 +615,24 @@ class App:
         return False
 
 
-    def get_chip(self, x, y):
-        if x in range(App.BOX_WIDTH) and y in range(App.BOX_HEIGHT) :
-            return self.box[x][y]
-        else :
-            return Chip(x, y, 100*x + y )   # 範囲外用のダミー、typeは識別できる値(描画することはない)
-
-
-    def check_tenpai(self, x, y):
-        # 右方向2連
-        if self.get_chip(x+1, y).type == self.get_chip(x+2, y).type :
-            if (self.get_chip(x+1, y).type == self.get_chip(x, y-1).type or
-                self.get_chip(x+1, y).type == self.get_chip(x, y+1).type or
-                self.get_chip(x+1, y).type == self.get_chip(x-1, y).type ):
-                return True
-
-        # 左方向2連
-        if self.get_chip(x-1, y).type == self.get_chip(x-2, y).type :
-            if (self.get_chip(x-1, y).type == self.get_chip(x, y-1).type or
-                self.get_chip(x-1, y).type == self.get_chip(x, y+1).type or
-                self.get_chip(x-1, y).type == self.get_chip(x+1, y).type ):
-                return True
-
-        # 上方向2連
-        if self.get_chip(x, y-1).type == self.get_chip(x, y-2).type :
-            if (self.get_chip(x, y-1).type == self.get_chip(x-1, y).type or
-                self.get_chip(x, y-1).type == self.get_chip(x+1, y).type or
-                self.get_chip(x, y-1).type == self.get_chip(x, y+1).type ):
-                return True
-
-        # 下方向2連
-        if self.get_chip(x, y+1).type == self.get_chip(x, y+2).type :
-            if (self.get_chip(x, y+1).type == self.get_chip(x-1, y).type or
-                self.get_chip(x, y+1).type == self.get_chip(x+1, y).type or
-                self.get_chip(x, y+1).type == self.get_chip(x, y-1).type ):
-                return True
-
-        # 縦カンチャン
-        if self.get_chip(x, y-1).type == self.get_chip(x, y+1).type :
-            if (self.get_chip(x, y-1).type == self.get_chip(x-1, y).type or
-                self.get_chip(x, y-1).type == self.get_chip(x+1, y).type ) :
-                return True
-
-        # 横カンチャン
-        if self.get_chip(x-1, y).type == self.get_chip(x+1, y).type :
-            if (self.get_chip(x-1, y).type == self.get_chip(x, y-1).type or
-                self.get_chip(x-1, y).type == self.get_chip(x, y+1).type ) :
-                return True
-
-
-        return False
-
-
     def check_tenpai_all(self):
-        count = 0
-        for y in range(App.BOX_HEIGHT) :
-            for x in range(App.BOX_WIDTH) :
-                if self.check_tenpai(x, y) :
-                    self.box[x][y].tenpai = True
-                    count += 1
-                else :
-                    self.box[x][y].tenpai = False
+        count = self.board.update_moves()
+        for x in range(App.BOX_WIDTH) :
+            for y in range(App.BOX_HEIGHT) :
+                self.box[x][y].tenpai = self.board.is_tenpai(self.board.index(x, y))
         return count
 
     def check_match(self):
-        matched = False
-        # 横チェック
-        for y in range(App.BOX_HEIGHT) :
-            for x in range(App.BOX_WIDTH-2) :
-                if self.box[x][y].type == self.box[x+1][y].type == self.box[x+2][y].type :
-                    self.box[x][y].match = self.box[x+1][y].match = self.box[x+2][y].match = True
-                    matched = True
-
-        # 縦チェック
-        for x in range(App.BOX_WIDTH) :
-            for y in range(App.BOX_HEIGHT - 2) :
-                if self.box[x][y].type == self.box[x][y+1].type == self.box[x][y+2].type :
-                    self.box[x][y].match = self.box[x][y+1].match = self.box[x][y+2].match = True
-                    matched = True
+        self.match_groups = self.board.check_match()
+        if not self.match_groups :
+            return False
 
-        return matched
+        # 描画用に点滅させる
+        for group in self.match_groups :
+            for i in group :
+                x, y = self.board.xy(i)
+                self.box[x][y].match = True
+        return True
 
     def get_drag_chip(self) :
         return self.box[self.drag.x][self.drag.y]
@@ -477,24 +651,19 @@ class App:
 
 
     def delete_chips(self) :
-        count =0
-        for x in range(App.BOX_WIDTH):
-            for y in range(App.BOX_HEIGHT-1,-1,-1):
-                if self.box[x][y].match :
-                    self.box[x][y] = None
-                    count+=1
-        return count
+        deleted = self.board.delete()
+        for i in deleted :
+            x, y = self.board.xy(i)
+            self.box[x][y] = None
+        return len(deleted)
 
     def drop_chips(self) :
-        for x in range(App.BOX_WIDTH):
-            for y in range(App.BOX_HEIGHT-1, -1 ,-1):   # 下から上に処理
-                if self.box[x][y] is None :
-                    for i in range(y-1, -1, -1) :
-                        if self.box[x][i] is not None :
-                            self.box[x][y] = self.box[x][i]
-                            self.box[x][y].set_dst(self.x2posx(x), self.y2posy(y))
-                            self.box[x][i] = None
-                            break
+        for src, dst in self.board.drop() :
+            x, src_y = self.board.xy(src)
+            x, y = self.board.xy(dst)
+            self.box[x][y] = self.box[x][src_y]
+            self.box[x][y].set_dst(self.x2posx(x), self.y2posy(y))
+            self.box[x][src_y] = None
 
     def is_dropped_all(self) :
         for x in range(App.BOX_WIDTH):
@@ -513,10 +682,9 @@ class App:
         return True
 
     def refill_chips(self) :
-        for x in range(App.BOX_WIDTH):
-            for y in range(App.BOX_HEIGHT):
-                if self.box[x][y] is None:
-                    self.box[x][y] = Chip(self.x2posx(x), self.y2posy(y-1), pyxel.rndi(1, self.max_type), self.x2posx(x), self.y2posy(y))
+        for i in self.board.refill(self.max_type) :
+            x, y = self.board.xy(i)
+            self.box[x][y] = self.new_chip(x, y)
 
     def is_release(self):
         return self.drag == self.drag2
@@ -524,7 +692,7 @@ class App:
     def is_swapable(self):
         swapable = [(0, 1), (0, -1), (1, 0), (-1, 0)]
 
-        if self.get_drag_chip().type == self.get_drag2_chip().type :
+        if self.GetChipType(self.drag) == self.GetChipType(self.drag2) :
             return False
 
         dx = self.drag2.x - self.drag.x
@@ -546,7 +714,7 @@ class App:
         self.score += add_score
         self.set_top_extra_text(f"+ {add_score}")
         self.add_timer_action(self.clear_top_extra_text, 6)
-        Debug.print(f"count = {count}, combo = {self.combo}, add = {add_score}")
+        Debug.print(f"count = {count}, groups = {[len(group) for group in self.match_groups]}, combo = {self.combo}, add = {add_score}")
 
         self.se.get_score(self.combo)
 
@@ -0,0 +1,118 @@
+# title: Pyxel Image Helper ベイク
+# author: daraddara5656
+# desc: フォルダ内の画像をイメージバンクに詰め込み、.pyxres、パレット、索引ファイルに書き出す
+
+import os
+# ウィンドウを開かずに実行する (環境変数で指定されている場合はそちらを優先)
+os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')
+
+import argparse
+import glob
+import json
+import sys
+
+import pyxel
+from pyxel_image_helper import BAKE_VERSION, ImageManager
+
+def find_images(directory):
+    """
+    フォルダ内のpngファイルを名前順に返す。ファイル名が'_'で始まるものはスキップする (sample.pyと同じ規則)。
+
+    Args:
+        directory (str): 画像ファイルのフォルダ
+
+    Returns:
+        list: 画像ファイル名のリスト
+    """
+    return [
+        filename for filename in sorted(glob.glob(os.path.join(directory, '*.png')))
+        if not os.path.basename(filename).startswith('_')
+    ]
+
+def bake(directory, output, banks=None, quantize=False, skip_errors=False):
+    """
+    フォルダ内の画像を読み込んでイメージバンクに詰め込み、.pyxres、パレット (.pyxpal)、索引 (.json) に書き出す。
+    pyxel.initを呼び出した後に実行すること。
+
+    Args:
+        directory (str): 画像ファイルのフォルダ
+        output (str): 書き出す.pyxresファイル名。パレットと索引は拡張子を変えた同じ名前で書き出す
+        banks (list): 使用するイメージバンクの番号のリスト。省略した場合はすべてのイメージバンクを使う
+        quantize (bool): Trueの場合、パレットの上限を超えるときは減色して読み込む
+        skip_errors (bool): Trueの場合、読み込みに失敗した画像を警告を出して飛ばす
+
+    Returns:
+        dict: 書き出した索引の内容
+
+    Raises:
+        ValueError: 画像がない場合、読み込みに失敗した場合、またはイメージバンクに収まらない場合
+    """
+    filenames = find_images(directory)
+    if not filenames:
+        raise ValueError(f"{directory} に画像ファイルがありません")
+
+    base = os.path.splitext(output)[0]
+    palette_filename = base + '.pyxpal'
+    index_filename = base + '.json'
+
+    with ImageManager() as image_manager:
+        if quantize:
+            image_manager.load_images_quantized(filenames)
+        else:
+            image_manager.load_images(filenames, skip_errors=skip_errors)
+        sprites = image_manager.build_atlas(banks)
+
+    # 索引ではフォルダからの相対パスを名前として使う
+    entries = {}
+    for filename, sprite in sprites.items():
+        name = os.path.relpath(filename, directory).replace(os.sep, '/')
+        entries[name] = {
+            'bank': sprite.bank,
+            'u': sprite.u,
+            'v': sprite.v,
+            'width': sprite.width,
+            'height': sprite.height,
+            'transparent_color': sprite.transparent_color,
+            'has_transparency': sprite.has_transparency,
+            'bounds': list(sprite.bounds) if sprite.bounds is not None else None,
+        }
+    index = {
+        'version': BAKE_VERSION,
+        'resource': os.path.basename(output),
+        'palette': os.path.basename(palette_filename),
+        'sprites': entries,
+    }
+
+    output_dir = os.path.dirname(os.path.abspath(output))
+    os.makedirs(output_dir, exist_ok=True)
+    pyxel.save(output, exclude_tilemaps=True, exclude_sounds=True, exclude_musics=True)
+    pyxel.save_pal(palette_filename)
+    with open(index_filename, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+    return index
+
+def main():
+    """コマンドライン引数を読み取り、ベイクを実行する。"""
+    parser = argparse.ArgumentParser(description="フォルダ内の画像を.pyxresとパレットと索引ファイルに書き出します。")
+    parser.add_argument('directory', help="画像ファイルのフォルダ")
+    parser.add_argument('output', help="書き出す.pyxresファイル名")
+    parser.add_argument('--banks', type=int, nargs='+', help="使用するイメージバンクの番号")
+    parser.add_argument('--quantize', action='store_true', help="パレットの上限を超える場合に減色する")
+    parser.add_argument('--skip-errors', action='store_true', help="読み込みに失敗した画像を飛ばす")
+    args = parser.parse_args()
+
+    # pyxel.initは作業ディレクトリを変更するため、先に絶対パスにしておく
+    directory = os.path.abspath(args.directory)
+    output = os.path.abspath(args.output)
+
+    pyxel.init(pyxel.IMAGE_SIZE, pyxel.IMAGE_SIZE, title="Pyxel Image Helper Bake")
+    try:
+        index = bake(directory, output, args.banks, args.quantize, args.skip_errors)
+    except ValueError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"{len(index['sprites'])}枚の画像を {output} に書き出しました")
+
+if __name__ == '__main__':
+    main()
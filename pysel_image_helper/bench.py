@@ -0,0 +1,240 @@
+# title: Pyxel Image Helper ベンチマーク
+# author: daraddara5656
+# desc: 合成した画像でPyxel Image Helperの読み込みと描画の速度を計測し、結果をJSONで出力する
+
+import os
+# ウィンドウを開かずに実行する (環境変数で指定されている場合はそちらを優先)
+os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')
+
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import pyxel
+from PIL import Image
+from pyxel_image_helper import DecodedImage, ImageManager, PyxelImageResource
+
+# 合成画像の色を選ぶ色の数 (既定の16色と合わせてパレットの上限255色に収まる数)
+COLOR_POOL_SIZE = 200
+# --compareで前回と一致している必要がある計測の条件
+COMPARED_CONFIG = ('count', 'size', 'colors', 'seed')
+
+def generate_images(directory, count, size, colors, seed):
+    """
+    計測用の画像を合成してPNGファイルとして保存する。
+    各画像は共通の色の集まりから選んだcolors色を使い、透明な縁 (左上の色で、アルファ値が0) で囲まれる。
+    描画の計測で、透明な縁を除いた範囲を透過色付きで描画する処理を計測するため。
+
+    Args:
+        directory (str): 画像を保存するディレクトリ
+        count (int): 画像の枚数
+        size (int): 画像の幅と高さ
+        colors (int): 1枚の画像に使う色数
+        seed (int): 乱数のシード
+
+    Returns:
+        list: 保存した画像ファイル名のリスト
+    """
+    rng = random.Random(seed)
+    pool = [(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(COLOR_POOL_SIZE)]
+    filenames = []
+    for i in range(count):
+        image_colors = rng.sample(pool, colors)
+        key = image_colors[0]
+        image = Image.new('RGBA', (size, size), key + (0,))
+        pixels = image.load()
+        # 縁を透明なまま残し、内側を横縞とノイズで不透明に塗る
+        for y in range(1, size - 1):
+            row_color = image_colors[1 + y % (colors - 1)] if colors > 1 else key
+            for x in range(1, size - 1):
+                color = row_color if rng.random() < 0.75 else rng.choice(image_colors)
+                pixels[x, y] = color + (255,)
+        filename = os.path.join(directory, f"bench_{i:04d}.png")
+        image.save(filename)
+        filenames.append(filename)
+    return filenames
+
+def measure(func, repeat):
+    """
+    関数をrepeat回実行し、最も速かった実行時間を返す。
+
+    Args:
+        func (callable): 計測する関数。実行の前に準備が必要な場合は、準備をしてから計測対象の関数を返す
+        repeat (int): 実行回数
+
+    Returns:
+        float: 最も速かった実行時間 (ミリ秒)
+    """
+    best = None
+    for _ in range(repeat):
+        target = func()
+        start = time.perf_counter()
+        target()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_benchmarks(filenames, repeat, draw_frames):
+    """
+    各処理の時間を計測する。
+
+    Args:
+        filenames (list): 計測に使う画像ファイル名のリスト
+        repeat (int): 各計測の繰り返し回数 (最も速かった回を採用する)
+        draw_frames (int): 描画速度の計測で描画するフレーム数
+
+    Returns:
+        dict: 計測名から結果 (合計時間と1件あたりの時間) を引く辞書
+    """
+    results = {}
+    # 計測用に作成したImageManager (計測の後にパレットを適用して正しく終了させる)
+    managers = []
+
+    def record(name, total_ms, items):
+        results[name] = {
+            'total_ms': round(total_ms, 4),
+            'items': items,
+            'per_item_us': round(total_ms * 1000 / items, 4) if items else None,
+        }
+
+    # PNGファイルのデコード
+    record('decode', measure(lambda: lambda: [DecodedImage.from_file(f) for f in filenames], repeat), len(filenames))
+    decoded = [DecodedImage.from_file(f) for f in filenames]
+
+    # パレットの結合 (結合パレット内の割り当て先を決める)
+    def merge():
+        manager = ImageManager()
+        managers.append(manager)
+        return lambda: [manager._allocate_colors(f, d.palette, d.has_transparency) for f, d in zip(filenames, decoded)]
+    record('palette_merge', measure(merge, repeat), len(filenames))
+
+    # 色インデックスの置き換えとPyxelイメージへの書き込み
+    manager = ImageManager()
+    managers.append(manager)
+    color_maps = [manager._allocate_colors(f, d.palette, d.has_transparency) for f, d in zip(filenames, decoded)]
+    def remap():
+        targets = [pyxel.Image(d.width, d.height) for d in decoded]
+        def run():
+            for image, d, color_map in zip(targets, decoded, color_maps):
+                PyxelImageResource._write_pixels(image, d.pixels, PyxelImageResource._build_color_table(color_map))
+        return run
+    record('remap', measure(remap, repeat), len(filenames))
+
+    # load_imageによる読み込み全体 (デコードから画像リソースの作成まで)
+    def load():
+        manager = ImageManager()
+        managers.append(manager)
+        return lambda: [manager.load_image(f) for f in filenames]
+    record('load_image', measure(load, repeat), len(filenames))
+
+    # PyxelImageResource.drawの描画速度
+    resources = [manager.load_image(f) for f in filenames]
+    manager.apply_palette_to_pyxel()
+    def draw():
+        def run():
+            for _ in range(draw_frames):
+                pyxel.cls(0)
+                for i, resource in enumerate(resources):
+                    resource.draw(i % 8 * 16, i // 8 % 8 * 16)
+        return run
+    draws = draw_frames * len(resources)
+    record('draw', measure(draw, repeat), draws)
+    results['draw']['draws_per_sec'] = round(draws / (results['draw']['total_ms'] / 1000)) if results['draw']['total_ms'] else None
+
+    for manager in managers:
+        manager.apply_palette_to_pyxel()
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    前回の計測結果と比べて、遅くなった計測を返す。
+
+    Args:
+        results (dict): 今回の計測結果
+        baseline (dict): 前回の計測結果 (このスクリプトが出力したJSON)
+        threshold (float): 遅くなったとみなす時間の比率
+
+    Returns:
+        list: 遅くなった計測の (計測名, 前回の時間, 今回の時間) のリスト
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('per_item_us') or result['per_item_us'] is None:
+            continue
+        if result['per_item_us'] > previous['per_item_us'] * threshold:
+            regressions.append((name, previous['per_item_us'], result['per_item_us']))
+    return regressions
+
+def main():
+    """コマンドライン引数を読み取り、計測を実行する。"""
+    parser = argparse.ArgumentParser(description="Pyxel Image Helperの読み込みと描画の速度を計測します。")
+    parser.add_argument('--count', type=int, default=32, help="合成する画像の枚数")
+    parser.add_argument('--size', type=int, default=32, help="合成する画像の幅と高さ")
+    parser.add_argument('--colors', type=int, default=8, help="1枚の画像に使う色数")
+    parser.add_argument('--repeat', type=int, default=5, help="各計測の繰り返し回数")
+    parser.add_argument('--draw-frames', type=int, default=60, help="描画速度の計測で描画するフレーム数")
+    parser.add_argument('--seed', type=int, default=0, help="画像の合成に使う乱数のシード")
+    parser.add_argument('--output', help="結果を書き込むJSONファイル。省略した場合は標準出力に書き込む")
+    parser.add_argument('--compare', help="比較する前回の結果のJSONファイル")
+    parser.add_argument('--threshold', type=float, default=1.2, help="遅くなったとみなす時間の比率")
+    args = parser.parse_args()
+
+    if not 1 <= args.colors <= COLOR_POOL_SIZE:
+        parser.error(f"--colorsは1から{COLOR_POOL_SIZE}の範囲で指定してください")
+    # pyxel.initは作業ディレクトリを変更するため、先に絶対パスにしておく
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    pyxel.init(256, 256, title="Pyxel Image Helper Benchmark")
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = generate_images(directory, args.count, args.size, args.colors, args.seed)
+        results = run_benchmarks(filenames, args.repeat, args.draw_frames)
+
+    report = {
+        'config': {
+            'count': args.count,
+            'size': args.size,
+            'colors': args.colors,
+            'repeat': args.repeat,
+            'draw_frames': args.draw_frames,
+            'seed': args.seed,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'pyxel': pyxel.VERSION,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        # 合成する画像の条件が異なる計測結果は比べられない (繰り返し回数とフレーム数は1件あたりの時間に影響しない)
+        previous_config = baseline.get('config', {})
+        differences = [key for key in COMPARED_CONFIG if previous_config.get(key) != report['config'][key]]
+        if differences:
+            for key in differences:
+                print(f"計測の条件が前回と異なります: {key} {previous_config.get(key)} -> {report['config'][key]}",
+                      file=sys.stderr)
+            print("条件が異なるため比較できません", file=sys.stderr)
+            sys.exit(2)
+        regressions = compare(results, baseline, args.threshold)
+        for name, previous, current in regressions:
+            print(f"遅くなりました: {name} {previous:.2f}us -> {current:.2f}us", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
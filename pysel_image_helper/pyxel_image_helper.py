@@ -2,45 +2,468 @@ import pyxel
 from PIL import Image
 import warnings
 import os
+import ctypes
+import math
+import io
+import json
+import mmap
+import struct
+import hashlib
+import fnmatch
+import heapq
+import sys
+import tempfile
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-DEBUG = False
+DEBUG = False  # Trueにすると、ImageManagerが読み込みの統計を記録し、withブロックの終了時に表示する
+MAX_COLORS = 255  # 結合パレットに使える色数の上限
+ALPHA_THRESHOLD = 128  # アルファ値がこれ未満のピクセルを透過として扱う
+BAKE_VERSION = 1  # bake.pyが書き出す索引ファイルの形式のバージョン
 
-class PyxelImageResource:
+# 色インデックス0 (透過色) を0に、それ以外を255に変換するテーブル
+_OPAQUE_TABLE = bytes([0]) + bytes([255]) * 255
+# 色インデックス0 (透過色) を文字'0'に、それ以外を文字'1'に変換するテーブル (当たり判定のビット列用)
+_MASK_BITS_TABLE = b'0' + b'1' * 255
+
+def _trim_region(x, y, u, v, width, height, bounds):
     """
-    個々の画像リソースを管理するクラス。
-    画像の読み込み、パレットの保持、描画機能を提供します。
+    描画する領域を、透過色以外のピクセルを囲む矩形に切り詰める。
+
+    Args:
+        x (int): 描画先のX座標
+        y (int): 描画先のY座標
+        u (int): 元画像のX座標
+        v (int): 元画像のY座標
+        width (int): 描画する幅
+        height (int): 描画する高さ
+        bounds (tuple): 透過色以外のピクセルを囲む矩形 (x0, y0, x1, y1)。Noneの場合は描画するものがない
+
+    Returns:
+        tuple: 切り詰めた (x, y, u, v, 幅, 高さ)。描画するものがない場合はNone
     """
-    @staticmethod
-    def _get_png_size_pil(file_path):
+    if bounds is None:
+        return None
+    x0, y0, x1, y1 = bounds
+    left = max(u, x0)
+    top = max(v, y0)
+    right = min(u + width, x1)
+    bottom = min(v + height, y1)
+    if left >= right or top >= bottom:
+        return None
+    return (x + left - u, y + top - v, left, top, right - left, bottom - top)
+
+def _normalize_path(filename):
+    """ファイルパスを、同じファイルを指すパスが同じ文字列になるように正規化する。"""
+    return os.path.normcase(os.path.abspath(filename))
+
+def _read_and_decode(filename, decode_cache=None, timed=False):
+    """
+    画像ファイルを読み込んで内容のハッシュを求め、デコードする。
+    プロセスプールからも呼び出せるように、モジュールの関数として定義している。
+
+    Args:
+        filename (str): 画像ファイル名
+        decode_cache (DecodeCache): デコード結果のキャッシュ。Noneの場合は読み込んだ内容をそのままデコードする
+        timed (bool): Trueの場合、デコードにかかった時間をdecode_timeに記録する
+
+    Returns:
+        tuple: (画像ファイルの内容のハッシュ, DecodedImage)
+
+    Raises:
+        ValueError: 画像を読み込めない場合
+    """
+    if decode_cache is not None:
+        # キャッシュが有効な場合は、キャッシュに記録したハッシュを使い、必要なときだけファイルを読む
+        start = time.perf_counter()
+        digest, decoded = decode_cache.load_entry(filename)
+    else:
+        data = DecodeCache._read_source(filename)
+        digest = hashlib.sha1(data).digest()
+        start = time.perf_counter()
+        decoded = DecodedImage.from_file(filename, data)
+    if timed:
+        decoded.decode_time = time.perf_counter() - start
+    return digest, decoded
+
+class DecodedImage:
+    """
+    画像ファイルを一度だけデコードした結果を保持するクラス。
+    サイズ、パレット、透過情報、色インデックスのピクセルデータをまとめて扱います。
+    """
+    def __init__(self, width, height, palette, pixels, has_transparency):
         """
-        PILライブラリを使用してPNG画像のサイズを取得する静的メソッド。
-        
+        DecodedImageのコンストラクタ。
+
         Args:
-            file_path (str): PNG画像ファイルのパス
-        
+            width (int): 画像の幅
+            height (int): 画像の高さ
+            palette (list): 画像のパレット (0xRRGGBB形式の整数のリスト)
+            pixels (bytes): 行優先で並んだ色インデックスのピクセルデータ
+            has_transparency (bool): 画像が透過情報を含むか
+        """
+        self.width = width
+        self.height = height
+        self.palette = palette
+        self.pixels = pixels
+        self.has_transparency = has_transparency
+        self.decode_time = None  # デコードにかかった時間 (秒)。統計を記録する場合のみ設定される
+        self.cache_hit = None  # DecodeCacheから復元した場合はTrue、デコードした場合はFalse。キャッシュを使わない場合はNone
+
+    @classmethod
+    def from_file(cls, filename, data=None):
+        """
+        画像ファイルを1回だけデコードし、DecodedImageを生成するクラスメソッド。
+        パレットはPyxelの読み込みと同じく、ピクセルに最初に現れた順に並べる。
+        アルファ値で透過しているピクセルがある場合は、それらを色インデックス0 (透過色) にまとめ、
+        不透明なピクセルの色とは区別する。
+
+        Args:
+            filename (str): 画像ファイル名
+            data (bytes): 読み込み済みのファイルの内容。省略した場合はファイルから読み込む
+
         Returns:
-            tuple: (width, height) の形式でサイズを返す。エラーの場合は (None, None) を返す。
-        
+            DecodedImage: デコード結果
+
         Raises:
-            FileNotFoundError: ファイルが見つからない場合
-            IOError: ファイル読み込みエラーが発生した場合
+            ValueError: 画像を読み込めない場合、または色数が256色を超える場合
         """
         try:
-            with Image.open(file_path) as img:
-                width, height = img.size
-                return (width, height)
-        
-        except FileNotFoundError:
-            print(f"エラー: ファイル '{file_path}' が見つかりません。")
-            return None, None
-        except IOError as e:
-            print(f"画像読み込みエラー: {e}")
-            return None, None
-        except Exception as e:
-            print(f"予期しないエラー: {e}")
-            return None, None
-
-    def __init__(self, filename, palette_offset=0):
+            with Image.open(filename if data is None else io.BytesIO(data)) as img:
+                # 画像に透過情報が含まれているか確認
+                has_transparency = 'transparency' in img.info or img.mode == 'RGBA'
+                rgb_img = img.convert('RGB')
+                # 実際にアルファ値で透過しているピクセルのマスク (不透明なピクセルが255)
+                alpha_mask = None
+                if has_transparency:
+                    alpha_mask = img.convert('RGBA').getchannel('A').point(
+                        lambda a: 255 if a >= ALPHA_THRESHOLD else 0)
+                    if alpha_mask.getextrema()[0] == 255:
+                        alpha_mask = None
+        except (FileNotFoundError, IOError) as e:
+            raise ValueError(f"画像を読み込めませんでした: {filename} - {e}")
+
+        colors = rgb_img.getcolors(256)
+        if colors is None:
+            raise ValueError(f"{filename} の色数が256色を超えています")
+
+        # 256色以下の画像ではメディアンカットは色を減らさないため、ピクセルを正確に色インデックスへ変換できる
+        indexed_img = rgb_img.quantize(colors=256, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+        indexed = indexed_img.tobytes()
+        flat_palette = indexed_img.getpalette()
+        packed_palette = [
+            (flat_palette[i] << 16) | (flat_palette[i + 1] << 8) | flat_palette[i + 2]
+            for i in range(0, len(flat_palette), 3)
+        ]
+
+        if alpha_mask is None:
+            # Pyxelと同じく、最初に現れた順に色インデックスを振り直す
+            # 透過情報を持つ画像では、最初の色 (左上のピクセルの色) が透過色になる
+            order = list(dict.fromkeys(indexed))
+            palette = [packed_palette[i] for i in order]
+        else:
+            if len(colors) > 255:
+                raise ValueError(f"{filename} の色数が透過色を含めて256色を超えています")
+            # 不透明なピクセルは色インデックスを1つずらし、透過しているピクセルを0にする
+            shifted = indexed.translate(bytes(min(i + 1, 255) for i in range(256)))
+            indexed = Image.composite(
+                Image.frombytes('L', rgb_img.size, shifted), Image.new('L', rgb_img.size, 0), alpha_mask
+            ).tobytes()
+            # 透過色を先頭に、不透明な色を最初に現れた順に並べる
+            order = list(dict.fromkeys(bytes([0]) + indexed))
+            # 透過色には最初の透過ピクセルの色を使う (透過を無効にして描画した場合に表示される)
+            key = shifted[indexed.index(0)]
+            palette = [packed_palette[i - 1] for i in [key] + order[1:]]
+
+        table = bytearray(256)
+        for new_index, old_index in enumerate(order):
+            table[old_index] = new_index
+        pixels = indexed.translate(table)
+
+        return cls(rgb_img.width, rgb_img.height, palette, pixels, has_transparency)
+
+class DecodeCache:
+    """
+    デコード結果をディスクに保存し、次回の起動時に再利用するクラス。
+    キャッシュはファイルのパス、サイズ、更新時刻、内容のハッシュで照合し、
+    一致した場合はPILを使わずにメモリマップしたキャッシュからデコード結果を復元します。
+    """
+    MAGIC = b'PXIC'
+    VERSION = 2
+    # マジック, バージョン, 幅, 高さ, 透過, パレットの色数, ファイルサイズ, 更新時刻(ns), 内容のハッシュ
+    HEADER = struct.Struct('<4sHHHBHQq20s')
+
+    def __init__(self, cache_dir):
+        """
+        DecodeCacheのコンストラクタ。
+
+        Args:
+            cache_dir (str): キャッシュファイルを保存するディレクトリ
+        """
+        self.cache_dir = cache_dir
+        self.hits = 0  # キャッシュから復元した回数
+        self.misses = 0  # 画像をデコードした回数
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self, filename, data=None):
+        """
+        画像のデコード結果を返す。キャッシュが有効ならキャッシュから復元し、
+        無効ならデコードしてキャッシュを更新する。
+
+        Args:
+            filename (str): 画像ファイル名
+            data (bytes): 読み込み済みの画像ファイルの内容。省略した場合は必要なときだけファイルから読み込む
+
+        Returns:
+            DecodedImage: デコード結果
+
+        Raises:
+            ValueError: 画像を読み込めない場合
+        """
+        return self.load_entry(filename, data)[1]
+
+    def load_entry(self, filename, data=None):
+        """
+        画像ファイルの内容のハッシュとデコード結果を返す。
+        サイズと更新時刻がキャッシュと一致する場合は、画像ファイルを読まずにキャッシュに記録したハッシュを返す。
+
+        Args:
+            filename (str): 画像ファイル名
+            data (bytes): 読み込み済みの画像ファイルの内容。省略した場合は必要なときだけファイルから読み込む
+
+        Returns:
+            tuple: (画像ファイルの内容のハッシュ, DecodedImage)
+
+        Raises:
+            ValueError: 画像を読み込めない場合
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError as e:
+            raise ValueError(f"画像を読み込めませんでした: {filename} - {e}")
+
+        cache_path = self._cache_path(filename)
+        data_digest = None
+        cached = self._read(cache_path)
+        if cached is not None:
+            header, decoded = cached
+            size, mtime_ns, digest = header[6:]
+            if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+                self.hits += 1
+                decoded.cache_hit = True
+                return digest, decoded
+
+            # 更新時刻だけが変わった場合は、内容のハッシュが一致すればキャッシュを使う
+            if data is None:
+                data = self._read_source(filename)
+            data_digest = hashlib.sha1(data).digest()
+            if size == len(data) and digest == data_digest:
+                self.hits += 1
+                decoded.cache_hit = True
+                self._write(cache_path, decoded, stat, digest)
+                return digest, decoded
+
+        if data is None:
+            data = self._read_source(filename)
+        if data_digest is None:
+            data_digest = hashlib.sha1(data).digest()
+        self.misses += 1
+        decoded = DecodedImage.from_file(filename, data)
+        decoded.cache_hit = False
+        self._write(cache_path, decoded, stat, data_digest)
+        return data_digest, decoded
+
+    def _cache_path(self, filename):
+        """正規化したファイルパスからキャッシュファイルのパスを求める。"""
+        key = _normalize_path(filename)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pxic')
+
+    @staticmethod
+    def _read_source(filename):
+        """画像ファイルの内容を読み込む静的メソッド。"""
+        try:
+            with open(filename, 'rb') as f:
+                return f.read()
+        except OSError as e:
+            raise ValueError(f"画像を読み込めませんでした: {filename} - {e}")
+
+    def _read(self, cache_path):
+        """
+        キャッシュファイルをメモリマップして読み込む。
+
+        Args:
+            cache_path (str): キャッシュファイルのパス
+
+        Returns:
+            tuple: (ヘッダー, DecodedImage)。キャッシュが存在しないか壊れている場合はNone
+        """
+        try:
+            with open(cache_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header = self.HEADER.unpack_from(mm)
+                magic, version, width, height, has_transparency, num_colors = header[:6]
+                if magic != self.MAGIC or version != self.VERSION:
+                    return None
+                offset = self.HEADER.size
+                palette_end = offset + num_colors * 4
+                pixels_end = palette_end + width * height
+                if len(mm) != pixels_end:
+                    return None
+                palette = list(struct.unpack_from(f'<{num_colors}I', mm, offset))
+                pixels = mm[palette_end:pixels_end]
+        except (OSError, ValueError, struct.error):
+            return None
+        return header, DecodedImage(width, height, palette, pixels, bool(has_transparency))
+
+    def _write(self, cache_path, decoded, stat, digest):
+        """
+        デコード結果をキャッシュファイルに書き込む。書き込みに失敗してもキャッシュを使わないだけで処理は続ける。
+
+        Args:
+            cache_path (str): キャッシュファイルのパス
+            decoded (DecodedImage): デコード結果
+            stat (os.stat_result): 画像ファイルの情報
+            digest (bytes): 画像ファイルの内容のハッシュ
+        """
+        header = self.HEADER.pack(
+            self.MAGIC, self.VERSION, decoded.width, decoded.height, decoded.has_transparency,
+            len(decoded.palette), stat.st_size, stat.st_mtime_ns, digest
+        )
+        palette = struct.pack(f'<{len(decoded.palette)}I', *decoded.palette)
+        temp_path = None
+        try:
+            # 同じ画像を並列に書き込んでも衝突しないように、一時ファイルの名前は書き込みごとに変える
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(palette)
+                f.write(decoded.pixels)
+            # 書き込み途中のファイルを読まないように、書き終えてから置き換える
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            warnings.warn(f"キャッシュを書き込めませんでした: {cache_path} - {e}", RuntimeWarning)
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+class CollisionMask:
+    """
+    画像の不透明なピクセルを、行ごとに1つの整数のビット列として保持する当たり判定用のマスク。
+    各行の整数は、X座標xのピクセルが不透明であればビットxが1になります。
+    重なりの判定は、まず不透明なピクセルを囲む矩形で大まかに調べ、
+    重なる場合だけ行ごとの整数のビット演算で調べます。
+    """
+    def __init__(self, width, height, rows):
+        """
+        CollisionMaskのコンストラクタ。
+
+        Args:
+            width (int): マスクの幅
+            height (int): マスクの高さ
+            rows (list): 各行の不透明なピクセルのビット列 (整数) のリスト
+        """
+        self.width = width
+        self.height = height
+        self.rows = rows
+        # 不透明なピクセルを囲む矩形 (x0, y0, x1, y1)。すべて透過している場合はNone
+        filled = [y for y, row in enumerate(rows) if row]
+        if filled:
+            left = min((row & -row).bit_length() - 1 for row in rows if row)
+            right = max(row.bit_length() for row in rows)
+            self.bounds = (left, filled[0], right, filled[-1] + 1)
+        else:
+            self.bounds = None
+
+    @classmethod
+    def from_pixels(cls, width, height, pixels, has_transparency):
+        """
+        色インデックスのピクセルデータからマスクを作成するクラスメソッド。
+
+        Args:
+            width (int): 画像の幅
+            height (int): 画像の高さ
+            pixels (bytes): 行優先で並んだ色インデックスのピクセルデータ (インデックス0が透過色)
+            has_transparency (bool): 画像が透過情報を含むか。Falseの場合はすべて不透明
+
+        Returns:
+            CollisionMask: 作成したマスク
+        """
+        if not has_transparency:
+            return cls(width, height, [(1 << width) - 1] * height)
+        # 1行を'0'と'1'の文字列に変換し、X座標0が最下位ビットになるように反転して整数にする
+        bits = pixels.translate(_MASK_BITS_TABLE)
+        rows = [int(bits[y * width:(y + 1) * width][::-1], 2) for y in range(height)]
+        return cls(width, height, rows)
+
+    def crop(self, u, v, width, height):
+        """
+        マスクの一部を切り出す。スプライトシートのフレームなどに使う。
+
+        Args:
+            u (int): 切り出すX座標
+            v (int): 切り出すY座標
+            width (int): 切り出す幅
+            height (int): 切り出す高さ
+
+        Returns:
+            CollisionMask: 切り出したマスク
+        """
+        keep = (1 << width) - 1
+        return CollisionMask(width, height, [(row >> u) & keep for row in self.rows[v:v + height]])
+
+    def overlaps(self, x, y, other, other_x, other_y, precise=True):
+        """
+        画面上の位置に置いた2つのマスクの不透明なピクセルが重なるか調べる。
+
+        Args:
+            x (int): このマスクを置くX座標
+            y (int): このマスクを置くY座標
+            other (CollisionMask): 相手のマスク
+            other_x (int): 相手のマスクを置くX座標
+            other_y (int): 相手のマスクを置くY座標
+            precise (bool): Falseの場合は不透明なピクセルを囲む矩形の重なりだけで判定する
+
+        Returns:
+            bool: 重なる場合はTrue
+        """
+        bounds = self.bounds
+        other_bounds = other.bounds
+        if bounds is None or other_bounds is None:
+            return False
+        # 不透明なピクセルを囲む矩形で大まかに判定する
+        left = max(x + bounds[0], other_x + other_bounds[0])
+        right = min(x + bounds[2], other_x + other_bounds[2])
+        top = max(y + bounds[1], other_y + other_bounds[1])
+        bottom = min(y + bounds[3], other_y + other_bounds[3])
+        if left >= right or top >= bottom:
+            return False
+        if not precise:
+            return True
+
+        # 重なる行だけ、相手のビット列をずらして論理積を調べる
+        rows = self.rows
+        other_rows = other.rows
+        shift = other_x - x
+        offset = other_y - y
+        if shift >= 0:
+            for row in range(top - y, bottom - y):
+                if rows[row] & (other_rows[row - offset] << shift):
+                    return True
+        else:
+            shift = -shift
+            for row in range(top - y, bottom - y):
+                if (rows[row] << shift) & other_rows[row - offset]:
+                    return True
+        return False
+
+class PyxelImageResource:
+    """
+    個々の画像リソースを管理するクラス。
+    画像の読み込み、パレットの保持、描画機能を提供します。
+    """
+    def __init__(self, filename, palette_offset=0, decoded=None, color_map=None, base=None):
         """
         PyxelImageResourceのコンストラクタ。
         画像を読み込み、パレット情報を抽出し、Pyxelイメージを作成します。
@@ -48,38 +471,205 @@ class PyxelImageResource:
         Args:
             filename (str): 画像ファイル名
             palette_offset (int): 結合パレット内でのこの画像のパレットの開始インデックス
+            decoded (DecodedImage): デコード済みの画像。省略した場合はファイルをデコードする
+            color_map (list): 画像の各色インデックスに対応する結合パレット内のインデックス。
+                省略した場合はpalette_offsetから連続して割り当てる
+            base (PyxelImageResource): 色違いの元になる画像リソース。指定した場合はピクセルデータを
+                元の画像と共有し、描画時にパレットの置き換えで色を変える
         """
-        try:
-            with Image.open(filename) as img:
-                # 画像に透過情報が含まれているか確認
-                self.has_transparency = 'transparency' in img.info or img.mode == 'RGBA'
-                if DEBUG:
-                    colors = img.getcolors()
-                    num_colors = len(colors) if colors else 0
-                    print(f"DEBUG: {filename} - ColorType: {img.mode}, Colors: {num_colors}, has_transparency: {self.has_transparency}")
-                size_x, size_y = img.size
-        except (FileNotFoundError, IOError) as e:
-            raise ValueError(f"画像を読み込めませんでした: {filename} - {e}")
+        if decoded is None:
+            decoded = DecodedImage.from_file(filename)
 
-        self.image = pyxel.Image(size_x, size_y)
-        # 画像とそのパレットを読み込む。この処理は一時的にpyxel.colorsを上書きする
-        self.image.load(0, 0, filename, incl_colors=True)
-        # 読み込んだ画像からパレットをリストとして保存
-        self.palette = pyxel.colors.to_list()
+        self.filename = filename
+        self._width = decoded.width
+        self._height = decoded.height
+        self.has_transparency = decoded.has_transparency
+        # 画像のパレットをリストとして保存
+        self.palette = list(decoded.palette)
 
-        if DEBUG:
-            hex_palette = [f"#{c:06x}" for c in self.palette]
-            print(f"DEBUG: {filename} - 生成されたパレットの色数: {len(self.palette)}, パレット: {hex_palette}")
+        # 結合パレット内の割り当て先。省略時はオフセットから連続して割り当てる
+        if color_map is None:
+            color_map = [palette_offset + index for index in range(len(self.palette))]
+        self.color_map = list(color_map)
 
         # 透過色としてパレットの最初の色を使用
-        self.transparent_color = palette_offset
+        self.transparent_color = self.color_map[0]
+        # 透過色以外のピクセルを囲む矩形 (x0, y0, x1, y1)。すべて透過している場合はNone
+        self.bounds = self._find_bounds(decoded)
+        self._spans = None
+        # 当たり判定用のマスク (色違いの画像は透過の形が同じなので元の画像のマスクを共有する)
+        if base is not None:
+            self.collision_mask = base.collision_mask
+        else:
+            self.collision_mask = CollisionMask.from_pixels(decoded.width, decoded.height, decoded.pixels,
+                                                            decoded.has_transparency)
+        # 減色して読み込んだ場合の誤差 (RMSE)。減色していない場合はNone
+        self.quantize_error = None
+
+        self.ref_count = 1  # このリソースを参照している数 (ImageManagerが管理する)
+        self._manager = None  # このリソースを管理しているImageManager
+
+        # 色違いの画像は元の画像のピクセルデータを共有し、描画時に色を置き換える
+        self._base = base
+        self._structure = None  # ImageManagerが色違いの判定に使うピクセルの並びのキー
+        self._digest = None  # ImageManagerが同じ内容の判定に使う画像ファイルの内容のハッシュ
+        if base is None:
+            self._pal_pairs = []
+            self._source_key = self.transparent_color
+            self._restore(decoded)
+        else:
+            self._pal_pairs = [(src, dst) for src, dst in zip(base.color_map, self.color_map) if src != dst]
+            # 透過色の判定は置き換え前の色で行われるため、元の画像の透過色を使う
+            self._source_key = base.transparent_color
+            self.image = None
+
+    @staticmethod
+    def _find_bounds(decoded):
+        """
+        透過色以外のピクセルを囲む矩形を求める静的メソッド。
+
+        Args:
+            decoded (DecodedImage): デコード済みの画像
+
+        Returns:
+            tuple: (x0, y0, x1, y1)。x1, y1は矩形の右端・下端の次の座標。すべて透過している場合はNone
+        """
+        if not decoded.has_transparency:
+            return (0, 0, decoded.width, decoded.height)
+        mask = Image.frombytes('L', (decoded.width, decoded.height), decoded.pixels.translate(_OPAQUE_TABLE))
+        return mask.getbbox()
+
+    def opaque_spans(self):
+        """
+        各行で透過色以外のピクセルが並ぶ範囲を返す。結果は最初の呼び出し時に求めて保持する。
+
+        Returns:
+            list: 行ごとの (開始X座標, 終了X座標の次) のタプル。すべて透過している行はNone
+        """
+        if self._base is not None:
+            return self._base.opaque_spans()
+        if self._spans is None:
+            image = self.ensure_image()
+            width = self._width
+            if not self.has_transparency:
+                self._spans = [(0, width)] * self._height
+            else:
+                data = bytes(image.data_ptr())
+                key = bytes([self.transparent_color])
+                self._spans = []
+                for y in range(self._height):
+                    row = data[y * width:(y + 1) * width]
+                    start = width - len(row.lstrip(key))
+                    self._spans.append((start, len(row.rstrip(key))) if start < width else None)
+        return self._spans
+
+    def _restore(self, decoded):
+        """
+        デコード済みの画像から、割り当て先に基づいて色インデックスを調整しながらPyxelイメージを作成する。
+
+        Args:
+            decoded (DecodedImage): デコード済みの画像
+        """
+        self.image = pyxel.Image(decoded.width, decoded.height)
+        self._write_pixels(self.image, decoded.pixels, self._build_color_table(self.color_map))
+
+    def ensure_image(self):
+        """
+        ピクセルデータがメモリ上にあることを保証してPyxelイメージを返す。
+        ImageManagerによってメモリから追い出されている場合は、ここで読み込み直す。
+
+        Returns:
+            pyxel.Image: この画像リソースのPyxelイメージ (色違いの画像では元の画像のPyxelイメージ)
+        """
+        if self._base is not None:
+            return self._base.ensure_image()
+        if self._manager is not None:
+            self._manager._touch(self)
+        return self.image
 
-        # パレットオフセットに基づいてピクセルの色インデックスを調整
-        if palette_offset > 0:
-            for x in range(size_x):
-                for y in range(size_y):
-                    color = self.image.pget(x, y)
-                    self.image.pset(x, y, color + palette_offset)
+    def copy_to(self, image, x, y):
+        """
+        この画像を別のPyxelイメージにそのままコピーする。色違いの画像は置き換えた色でコピーする。
+
+        Args:
+            image (pyxel.Image): コピー先のPyxelイメージ
+            x (int): コピー先のX座標
+            y (int): コピー先のY座標
+        """
+        source = self.ensure_image()
+        for src, dst in self._pal_pairs:
+            image.pal(src, dst)
+        image.blt(x, y, source, 0, 0, self._width, self._height)
+        if self._pal_pairs:
+            image.pal()
+
+    @staticmethod
+    def _build_color_table(color_map):
+        """
+        画像の色インデックスを結合パレット内のインデックスに変換する256エントリの変換テーブルを作成する静的メソッド。
+
+        Args:
+            color_map (list): 画像の各色インデックスに対応する結合パレット内のインデックス
+
+        Returns:
+            bytes: 変換前のインデックスを添字とする変換後インデックスのテーブル
+        """
+        table = bytearray(range(256))
+        table[:len(color_map)] = bytes(color_map)
+        return bytes(table)
+
+    @staticmethod
+    def _write_pixels(image, pixels, table):
+        """
+        変換テーブルで色インデックスを変換しながら、ピクセルデータをPyxelイメージに書き込む静的メソッド。
+        Pyxelイメージの生バッファを取得できる場合は一括で書き込み、
+        取得できない場合のみ1ピクセルずつ書き込む。
+
+        Args:
+            image (pyxel.Image): 書き込み先のPyxelイメージ
+            pixels (bytes): 行優先で並んだ色インデックスのピクセルデータ
+            table (bytes): 256エントリの色インデックス変換テーブル
+        """
+        remapped = pixels.translate(table)
+        data_ptr = getattr(image, 'data_ptr', None)
+        if data_ptr is not None:
+            # 変換済みのバッファを1回のコピーで書き込む
+            ctypes.memmove(data_ptr(), remapped, len(remapped))
+            return
+
+        # 生バッファを扱えない古いPyxel向けのフォールバック
+        width = image.width
+        for y in range(image.height):
+            for x in range(width):
+                image.pset(x, y, remapped[y * width + x])
+
+    def collides(self, x, y, other, other_x, other_y, precise=True):
+        """
+        画面上の位置に置いた2つの画像の不透明なピクセルが重なるか調べる。
+
+        Args:
+            x (int): この画像を置くX座標
+            y (int): この画像を置くY座標
+            other: 相手の画像 (collision_maskを持つPyxelImageResourceなど)、またはCollisionMask
+            other_x (int): 相手の画像を置くX座標
+            other_y (int): 相手の画像を置くY座標
+            precise (bool): Falseの場合は不透明なピクセルを囲む矩形の重なりだけで判定する
+
+        Returns:
+            bool: 重なる場合はTrue
+        """
+        other_mask = other if isinstance(other, CollisionMask) else other.collision_mask
+        return self.collision_mask.overlaps(x, y, other_mask, other_x, other_y, precise)
+
+    @property
+    def width(self):
+        """画像の幅。"""
+        return self._width
+
+    @property
+    def height(self):
+        """画像の高さ。"""
+        return self._height
 
     def draw(self, x, y, u=0, v=0, transparency_enabled=True):
         """
@@ -92,86 +682,2599 @@ class PyxelImageResource:
             v (int): 元画像のY座標
             transparency_enabled (bool): 透過を有効にするか
         """
+        self._blit(x, y, 0, 0, self._width, self._height, self.bounds, u, v, transparency_enabled)
+
+    def _blit(self, x, y, left, top, width, height, bounds, u, v, transparency_enabled, image=None):
+        """
+        画像内の矩形を画面に描画する。画像全体とスプライトシートのフレームの描画で共通の処理。
+
+        Args:
+            x (int): 描画先のX座標
+            y (int): 描画先のY座標
+            left (int): 矩形の画像内のX座標
+            top (int): 矩形の画像内のY座標
+            width (int): 矩形の幅
+            height (int): 矩形の高さ
+            bounds (tuple): 透過色以外のピクセルを囲む矩形内の矩形 (x0, y0, x1, y1)。Noneの場合はすべて透過
+            u (int): 矩形内のX座標
+            v (int): 矩形内のY座標
+            transparency_enabled (bool): 透過を有効にするか
+            image (pyxel.Image): 描画元のPyxelイメージ。省略した場合はこの画像リソースのPyxelイメージ
+        """
+        if image is None:
+            image = self.ensure_image()
+        # 色違いの画像は、元の画像の色を置き換えて描画する
+        for src, dst in self._pal_pairs:
+            pyxel.pal(src, dst)
         if self.has_transparency and transparency_enabled:
-            # 透過色を指定して描画
-            pyxel.blt(x, y, self.image, u, v, self.image.width, self.image.height, self.transparent_color)
+            # 透過色以外のピクセルを囲む矩形だけを、透過色を指定して描画
+            region = _trim_region(x, y, u, v, width, height, bounds)
+            if region is not None:
+                pyxel.blt(region[0], region[1], image, left + region[2], top + region[3], region[4], region[5],
+                          self._source_key)
         else:
             # 透過なしで描画
-            pyxel.blt(x, y, self.image, u, v, self.image.width, self.image.height)
+            pyxel.blt(x, y, image, left + u, top + v, width, height)
+        if self._pal_pairs:
+            pyxel.pal()
 
-class ImageManager:
+class SpriteFrame:
     """
-    複数の画像を管理し、それらのパレットを自動的に結合するクラス。
-    'with'ステートメントでの使用を想定しています。
+    スプライトシート内の1フレーム (矩形) を指す軽量な画像ハンドル。
+    ピクセルデータとパレットはシートの画像リソースと共有し、PyxelImageResourceと同じように描画できます。
     """
-    def __init__(self):
-        """ImageManagerのコンストラクタ。"""
-        self.combined_palette = pyxel.colors.to_list()  # 結合されたパレット
-        self.images = {}  # 読み込んだ画像リソースを保持する辞書
-        self._dirty = False  # パレットが変更されたかを示すフラグ
+    def __init__(self, resource, u, v, width, height, bounds, name=None):
+        """
+        SpriteFrameのコンストラクタ。
 
-    def load_image(self, filename):
+        Args:
+            resource (PyxelImageResource): スプライトシートの画像リソース
+            u (int): シート内のX座標
+            v (int): シート内のY座標
+            width (int): フレームの幅
+            height (int): フレームの高さ
+            bounds (tuple): 透過色以外のピクセルを囲むフレーム内の矩形 (x0, y0, x1, y1)。
+                すべて透過している場合はNone
+            name (str): フレームの名前
         """
-        画像を読み込み、パレットを管理し、PyxelImageResourceオブジェクトを返す。
-        
+        self.resource = resource
+        self.u = u
+        self.v = v
+        self.width = width
+        self.height = height
+        self.bounds = bounds
+        self.name = name
+
+    def draw(self, x, y, u=0, v=0, transparency_enabled=True):
+        """
+        このフレームを画面に描画する。
+
         Args:
-            filename (str): 画像ファイル名
-        
-        Returns:
-            PyxelImageResource: 生成された画像リソース
-        
-        Raises:
-            ValueError: パレット数の上限を超えるなど、読み込みに失敗した場合
+            x (int): 描画先のX座標
+            y (int): 描画先のY座標
+            u (int): フレーム内のX座標
+            v (int): フレーム内のY座標
+            transparency_enabled (bool): 透過を有効にするか
         """
-        # クラッシュを避けるために、パレットサイズを事前にチェック
-        try:
-            # 一時的なPyxelイメージに読み込む
-            with Image.open(filename) as pil_img:
-                temp_img = pyxel.Image(pil_img.width, pil_img.height)
-                # 画像とパレットを読み込む（pyxel.colorsが一時的に上書きされる）
-                temp_img.load(0, 0, filename, incl_colors=True)
-                # 読み込んだ画像からパレットを保存
-                image_palette = pyxel.colors.to_list()
-        except Exception as e:
-            raise ValueError(f"パレットチェックのための画像プリロードに失敗しました: {filename} - {e}")
-
-        # 結合後のパレット数が255色を超えるかチェック
-        if len(self.combined_palette) + len(image_palette) > 255:
-            # 一時的な読み込みで上書きされたグローバルパレットを元に戻す
-            pyxel.colors.from_list(self.combined_palette)
-            raise ValueError(f"{filename} を追加するとパレットの上限255色を超えてしまいます")
-        
-        # 新しい画像リソースを作成
-        palette_offset = len(self.combined_palette)
-        resource = PyxelImageResource(filename, palette_offset)
-        
-        # パレットと画像リソースをマネージャーに追加
-        self.combined_palette.extend(resource.palette)
-        self.images[filename] = resource
-        self._dirty = True
-        
-        return resource
+        self.resource._blit(x, y, self.u, self.v, self.width, self.height, self.bounds, u, v, transparency_enabled)
 
-    def apply_palette_to_pyxel(self):
-        """最終的に結合されたパレットをPyxelに適用する。"""
-        if self._dirty:
-            pyxel.colors.from_list(self.combined_palette)
-            self._dirty = False
+class TransformedSprite:
+    """
+    反転・回転・拡大した画像リソースを表す画像ハンドル。
+    VariantCacheによって生成され、変換済みのピクセルデータを持ちます。
+    """
+    def __init__(self, resource, image, bounds):
+        """
+        TransformedSpriteのコンストラクタ。
 
-    def __enter__(self):
-        """'with'ステートメントの開始時に呼び出される。"""
-        return self
+        Args:
+            resource (PyxelImageResource): 変換前の画像リソース (透過色と色の置き換えに使う)
+            image (pyxel.Image): 変換済みのPyxelイメージ
+            bounds (tuple): 透過色以外のピクセルを囲む矩形 (x0, y0, x1, y1)。すべて透過している場合はNone
+        """
+        self.resource = resource
+        self.image = image
+        self.width = image.width
+        self.height = image.height
+        self.bounds = bounds
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """'with'ステートメントの終了時に呼び出され、パレットを適用する。"""
-        self.apply_palette_to_pyxel()
+    def draw(self, x, y, u=0, v=0, transparency_enabled=True):
+        """
+        変換済みの画像を画面に描画する。
 
-    def __del__(self):
-        """インスタンス破棄時の処理。"""
-        # インスタンス破棄時に_dirtyフラグがTrueなら、パレットが適用されていない
-        if self._dirty:
-            warnings.warn(
-                "ImageManagerが正しく終了されませんでした。"
-                "'with'ステートメントを使用してパレットが適用されるようにしてください。",
-                ResourceWarning
-            )
+        Args:
+            x (int): 描画先のX座標
+            y (int): 描画先のY座標
+            u (int): 変換後の画像のX座標
+            v (int): 変換後の画像のY座標
+            transparency_enabled (bool): 透過を有効にするか
+        """
+        self.resource._blit(x, y, 0, 0, self.width, self.height, self.bounds, u, v, transparency_enabled,
+                            self.image)
+
+class VariantCache:
+    """
+    画像リソースを反転・回転・拡大した画像を、1回だけ作成して保持するクラス。
+    描画のたびに変換する代わりに変換済みの画像を選んで描画します。
+    保持するピクセルデータの合計には上限を設定でき、超えた場合は最も長く使われていないものから捨てます。
+    """
+    # 時計回りの回転角度に対応するPILの変換
+    _ROTATIONS = {
+        0: None,
+        90: Image.Transpose.ROTATE_270,
+        180: Image.Transpose.ROTATE_180,
+        270: Image.Transpose.ROTATE_90,
+    }
+
+    def __init__(self, max_bytes=None):
+        """
+        VariantCacheのコンストラクタ。
+
+        Args:
+            max_bytes (int): 保持するピクセルデータの上限 (バイト数)。省略した場合は上限なし
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (画像リソース, 変換) からTransformedSpriteを引く辞書 (古く使われた順)
+        self._bytes = 0
+        self.hits = 0  # 変換済みの画像があった回数
+        self.misses = 0  # 画像を変換した回数
+        self.evictions = 0  # 変換済みの画像を捨てた回数
+
+    def get(self, resource, flip_h=False, flip_v=False, rotate=0, scale=1):
+        """
+        変換済みの画像を返す。まだない場合は作成する。反転してから回転し、最後に拡大する。
+
+        Args:
+            resource (PyxelImageResource): 変換する画像リソース
+            flip_h (bool): 左右に反転するか
+            flip_v (bool): 上下に反転するか
+            rotate (int): 時計回りの回転角度 (0, 90, 180, 270)
+            scale (int): 拡大率 (1以上の整数)
+
+        Returns:
+            TransformedSprite: 変換済みの画像
+
+        Raises:
+            ValueError: 回転角度または拡大率が正しくない場合
+        """
+        key = (resource, bool(flip_h), bool(flip_v), rotate, scale)
+        sprite = self._entries.get(key)
+        if sprite is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return sprite
+
+        if rotate not in self._ROTATIONS:
+            raise ValueError(f"回転角度は0, 90, 180, 270のいずれかを指定してください: {rotate}")
+        if not isinstance(scale, int) or scale < 1:
+            raise ValueError(f"拡大率は1以上の整数を指定してください: {scale}")
+        self.misses += 1
+        sprite = self._bake(resource, flip_h, flip_v, rotate, scale)
+        self._entries[key] = sprite
+        self._bytes += sprite.width * sprite.height
+        self._enforce_limit()
+        return sprite
+
+    def draw(self, resource, x, y, flip_h=False, flip_v=False, rotate=0, scale=1, transparency_enabled=True):
+        """
+        変換済みの画像を画面に描画する。まだない場合は作成する。
+
+        Args:
+            resource (PyxelImageResource): 変換する画像リソース
+            x (int): 描画先のX座標
+            y (int): 描画先のY座標
+            flip_h (bool): 左右に反転するか
+            flip_v (bool): 上下に反転するか
+            rotate (int): 時計回りの回転角度 (0, 90, 180, 270)
+            scale (int): 拡大率 (1以上の整数)
+            transparency_enabled (bool): 透過を有効にするか
+        """
+        self.get(resource, flip_h, flip_v, rotate, scale).draw(x, y, transparency_enabled=transparency_enabled)
+
+    def discard(self, resource):
+        """
+        画像リソースの変換済みの画像をすべて捨てる。画像リソースをアンロードしたときに呼び出す。
+
+        Args:
+            resource (PyxelImageResource): 画像リソース
+        """
+        for key in [key for key in self._entries if key[0] is resource]:
+            sprite = self._entries.pop(key)
+            self._bytes -= sprite.width * sprite.height
+
+    def clear(self):
+        """変換済みの画像をすべて捨てる。"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self):
+        """
+        変換済みの画像のキャッシュの統計を返す。
+
+        Returns:
+            dict: ヒット数、ミス数、追い出し数、ヒット率、保持している画像数とバイト数、上限
+        """
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def _bake(self, resource, flip_h, flip_v, rotate, scale):
+        """
+        画像リソースのピクセルデータを変換して、新しいPyxelイメージを作成する。
+        色インデックスのままPILで変換するため、色が混ざることはない。
+
+        Returns:
+            TransformedSprite: 変換済みの画像
+        """
+        source = resource.ensure_image()
+        image = Image.frombytes('L', (resource.width, resource.height), bytes(source.data_ptr()))
+        if flip_h:
+            image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        if flip_v:
+            image = image.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+        if self._ROTATIONS[rotate] is not None:
+            image = image.transpose(self._ROTATIONS[rotate])
+        if scale > 1:
+            image = image.resize((image.width * scale, image.height * scale), Image.Resampling.NEAREST)
+
+        pixels = image.tobytes()
+        baked = pyxel.Image(image.width, image.height)
+        PyxelImageResource._write_pixels(baked, pixels, bytes(range(256)))
+
+        bounds = (0, 0, image.width, image.height)
+        if resource.has_transparency:
+            # 透過色を0、それ以外を255にしたマスクから、透過色以外を囲む矩形を求める
+            table = bytearray([255]) * 256
+            table[resource._source_key] = 0
+            bounds = Image.frombytes('L', image.size, pixels.translate(bytes(table))).getbbox()
+        return TransformedSprite(resource, baked, bounds)
+
+    def _enforce_limit(self):
+        """保持するピクセルデータの合計が上限を超えている間、最も長く使われていないものから捨てる。"""
+        if self.max_bytes is None:
+            return
+        # 直前に作成した画像は、上限を超えていても捨てない
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, sprite = self._entries.popitem(last=False)
+            self._bytes -= sprite.width * sprite.height
+            self.evictions += 1
+
+class SpriteSheet:
+    """
+    1つの画像をフレームに切り分けて扱うクラス。
+    画像は1回だけデコードされ、すべてのフレームが同じピクセルデータとパレットを共有します。
+    """
+    def __init__(self, resource):
+        """
+        SpriteSheetのコンストラクタ。
+
+        Args:
+            resource (PyxelImageResource): スプライトシートの画像リソース
+        """
+        self.resource = resource
+        self.frames = []  # 定義した順のフレームのリスト
+        self.named = {}  # 名前からフレームを引く辞書
+        self._mask = None  # フレームごとの透過範囲を求めるための不透明マスク
+
+    def slice_grid(self, frame_width, frame_height, margin=0, spacing=0, count=None):
+        """
+        シートを格子状に切り分け、左上から行ごとにフレームを追加する。
+
+        Args:
+            frame_width (int): フレームの幅
+            frame_height (int): フレームの高さ
+            margin (int): シートの端からの余白
+            spacing (int): フレーム間の間隔
+            count (int): 追加するフレーム数の上限。省略した場合は収まるだけ追加する
+
+        Returns:
+            list: 追加したフレームのリスト
+        """
+        added = []
+        v = margin
+        while v + frame_height <= self.resource.height:
+            u = margin
+            while u + frame_width <= self.resource.width:
+                if count is not None and len(added) >= count:
+                    return added
+                added.append(self.define(None, u, v, frame_width, frame_height))
+                u += frame_width + spacing
+            v += frame_height + spacing
+        return added
+
+    def define(self, name, u, v, width, height):
+        """
+        シート内の矩形をフレームとして追加する。
+
+        Args:
+            name (str): フレームの名前。Noneの場合は名前を付けない
+            u (int): シート内のX座標
+            v (int): シート内のY座標
+            width (int): フレームの幅
+            height (int): フレームの高さ
+
+        Returns:
+            SpriteFrame: 追加したフレーム
+
+        Raises:
+            ValueError: 矩形がシートからはみ出す場合
+        """
+        if u < 0 or v < 0 or u + width > self.resource.width or v + height > self.resource.height:
+            raise ValueError(f"フレーム ({u}, {v}, {width}, {height}) がシートからはみ出しています")
+        frame = SpriteFrame(self.resource, u, v, width, height, self._frame_bounds(u, v, width, height), name)
+        self.frames.append(frame)
+        if name is not None:
+            self.named[name] = frame
+        return frame
+
+    def _frame_bounds(self, u, v, width, height):
+        """
+        フレーム内で透過色以外のピクセルを囲む矩形を求める。
+
+        Returns:
+            tuple: フレーム内の矩形 (x0, y0, x1, y1)。すべて透過している場合はNone
+        """
+        resource = self.resource
+        if not resource.has_transparency:
+            return (0, 0, width, height)
+        if self._mask is None:
+            # 透過色を0、それ以外を255にしたマスクを1回だけ作り、フレームごとに切り出す
+            table = bytearray([255]) * 256
+            table[resource._source_key] = 0
+            data = bytes(resource.ensure_image().data_ptr()).translate(bytes(table))
+            self._mask = Image.frombytes('L', (resource.width, resource.height), data)
+        return self._mask.crop((u, v, u + width, v + height)).getbbox()
+
+    def __getitem__(self, key):
+        """番号または名前でフレームを返す。"""
+        if isinstance(key, str):
+            return self.named[key]
+        return self.frames[key]
+
+    def __len__(self):
+        """フレームの数を返す。"""
+        return len(self.frames)
+
+class FramePlayer:
+    """
+    フレームの並びを再生するクラス。
+    各フレームの表示時間から1ティックごとのフレーム番号の表を前もって作るため、
+    update()とframeの参照ではオブジェクトを作りません。
+    """
+    def __init__(self, frames, durations=1, loop=True):
+        """
+        FramePlayerのコンストラクタ。
+
+        Args:
+            frames (list): 再生するフレーム (SpriteFrameなど描画できるもの) のリスト
+            durations: 各フレームを表示するティック数。整数の場合はすべてのフレームで同じ
+            loop (bool): Trueの場合は最後のフレームの後に最初に戻る。Falseの場合は最後のフレームで止まる
+
+        Raises:
+            ValueError: フレームがない場合、またはフレームと表示時間の数が合わない場合
+        """
+        if not frames:
+            raise ValueError("再生するフレームがありません")
+        if isinstance(durations, int):
+            durations = [durations] * len(frames)
+        if len(durations) != len(frames):
+            raise ValueError("フレームの数と表示時間の数が一致しません")
+        self.frames = tuple(frames)
+        self.loop = loop
+        # ティックから表示するフレームの番号を引く表
+        self._timeline = tuple(index for index, duration in enumerate(durations) for _ in range(duration))
+        if not self._timeline:
+            raise ValueError("表示時間の合計が0です")
+        self._length = len(self._timeline)
+        self.tick = 0
+
+    @property
+    def frame(self):
+        """現在のフレーム。"""
+        return self.frames[self._timeline[self.tick]]
+
+    @property
+    def index(self):
+        """現在のフレームの番号。"""
+        return self._timeline[self.tick]
+
+    @property
+    def finished(self):
+        """ループしない場合に、最後のフレームまで再生し終えたか。"""
+        return not self.loop and self.tick == self._length - 1
+
+    def update(self, ticks=1):
+        """
+        再生位置を進める。毎フレーム呼び出す。
+
+        Args:
+            ticks (int): 進めるティック数
+        """
+        tick = self.tick + ticks
+        if tick >= self._length:
+            tick = tick % self._length if self.loop else self._length - 1
+        self.tick = tick
+
+    def reset(self):
+        """再生位置を最初に戻す。"""
+        self.tick = 0
+
+    def draw(self, x, y, transparency_enabled=True):
+        """
+        現在のフレームを画面に描画する。
+
+        Args:
+            x (int): 描画先のX座標
+            y (int): 描画先のY座標
+            transparency_enabled (bool): 透過を有効にするか
+        """
+        self.frames[self._timeline[self.tick]].draw(x, y, transparency_enabled=transparency_enabled)
+
+class AtlasSprite:
+    """
+    イメージバンク内の矩形を指す軽量な画像ハンドル。
+    AtlasBuilderによって生成され、PyxelImageResourceと同じように描画できます。
+    """
+    def __init__(self, bank, u, v, width, height, transparent_color, has_transparency, bounds=None):
+        """
+        AtlasSpriteのコンストラクタ。
+
+        Args:
+            bank (int): イメージバンクの番号
+            u (int): イメージバンク内のX座標
+            v (int): イメージバンク内のY座標
+            width (int): 画像の幅
+            height (int): 画像の高さ
+            transparent_color (int): 透過色のパレットインデックス
+            has_transparency (bool): 画像が透過情報を含むか
+            bounds (tuple): 透過色以外のピクセルを囲む画像内の矩形 (x0, y0, x1, y1)。省略した場合は画像全体
+        """
+        self.bank = bank
+        self.u = u
+        self.v = v
+        self.width = width
+        self.height = height
+        self.transparent_color = transparent_color
+        self.has_transparency = has_transparency
+        self.bounds = bounds if bounds is not None else (0, 0, width, height)
+
+    def draw(self, x, y, u=0, v=0, transparency_enabled=True):
+        """
+        この画像をイメージバンクから画面に描画する。
+
+        Args:
+            x (int): 描画先のX座標
+            y (int): 描画先のY座標
+            u (int): 元画像のX座標
+            v (int): 元画像のY座標
+            transparency_enabled (bool): 透過を有効にするか
+        """
+        if self.has_transparency and transparency_enabled:
+            # 透過色以外のピクセルを囲む矩形だけを、透過色を指定して描画
+            region = _trim_region(x, y, u, v, self.width, self.height, self.bounds)
+            if region is not None:
+                pyxel.blt(region[0], region[1], self.bank, self.u + region[2], self.v + region[3],
+                          region[4], region[5], self.transparent_color)
+        else:
+            # 透過なしで描画
+            pyxel.blt(x, y, self.bank, self.u + u, self.v + v, self.width, self.height)
+
+class AtlasBuilder:
+    """
+    複数の画像リソースをPyxelのイメージバンク (256x256) に詰め込むクラス。
+    スカイライン法で配置を決め、各画像をイメージバンク内の矩形を指すAtlasSpriteに置き換えます。
+    """
+    def __init__(self, banks=None):
+        """
+        AtlasBuilderのコンストラクタ。
+
+        Args:
+            banks (list): 使用するイメージバンクの番号のリスト。省略した場合はすべてのイメージバンクを使う
+        """
+        self.banks = list(banks) if banks is not None else list(range(pyxel.NUM_IMAGES))
+        self.size = pyxel.IMAGE_SIZE
+        self._entries = []  # (名前, 画像リソース) のリスト
+
+    def add(self, name, resource):
+        """
+        イメージバンクに詰め込む画像リソースを追加する。
+
+        Args:
+            name: 画像を識別する名前
+            resource (PyxelImageResource): 画像リソース
+        """
+        self._entries.append((name, resource))
+
+    def build(self):
+        """
+        追加された画像リソースをイメージバンクに詰め込む。
+
+        Returns:
+            dict: 名前をキーとするAtlasSpriteの辞書
+
+        Raises:
+            ValueError: イメージバンクに収まらない画像がある場合
+        """
+        # 高さ (同じ場合は幅) が大きい順に配置すると隙間が少なくなる
+        order = sorted(self._entries, key=lambda entry: (-entry[1].height, -entry[1].width))
+        skylines = {bank: [[0, 0, self.size]] for bank in self.banks}
+        sprites = {}
+        for name, resource in order:
+            placement = None
+            for bank in self.banks:
+                position = self._find_position(skylines[bank], resource.width, resource.height)
+                if position is not None:
+                    placement = (bank, position)
+                    break
+            if placement is None:
+                raise ValueError(f"{name} をイメージバンクに配置できません")
+
+            bank, (index, u, v) = placement
+            self._place(skylines[bank], index, u, v, resource.width, resource.height)
+            # 画像をイメージバンクの配置先にそのままコピーする
+            resource.copy_to(pyxel.images[bank], u, v)
+            sprites[name] = AtlasSprite(bank, u, v, resource.width, resource.height,
+                                        resource.transparent_color, resource.has_transparency, resource.bounds)
+        return sprites
+
+    def _find_position(self, skyline, width, height):
+        """
+        スカイライン上で、矩形を最も低い位置 (同じ場合は最も左) に置ける場所を探す。
+
+        Args:
+            skyline (list): [x, y, 幅] の区間のリスト
+            width (int): 矩形の幅
+            height (int): 矩形の高さ
+
+        Returns:
+            tuple: (区間のインデックス, x, y)。置ける場所がない場合はNone
+        """
+        best = None
+        for index, (x, _, _) in enumerate(skyline):
+            if x + width > self.size:
+                break
+            # 矩形の幅に掛かる区間のうち、最も高い位置に載せる
+            y = 0
+            remaining = width
+            for segment_x, segment_y, segment_width in skyline[index:]:
+                y = max(y, segment_y)
+                remaining -= segment_width
+                if remaining <= 0:
+                    break
+            if y + height > self.size:
+                continue
+            if best is None or (y, x) < (best[2], best[1]):
+                best = (index, x, y)
+        return best
+
+    @staticmethod
+    def _place(skyline, index, x, y, width, height):
+        """
+        スカイラインに矩形を置き、区間を更新する静的メソッド。
+
+        Args:
+            skyline (list): [x, y, 幅] の区間のリスト
+            index (int): 矩形を置く区間のインデックス
+            x (int): 矩形のX座標
+            y (int): 矩形のY座標
+            width (int): 矩形の幅
+            height (int): 矩形の高さ
+        """
+        skyline.insert(index, [x, y + height, width])
+        # 新しい区間に隠れた区間を削る
+        right = x + width
+        i = index + 1
+        while i < len(skyline) and skyline[i][0] < right:
+            segment = skyline[i]
+            segment_right = segment[0] + segment[2]
+            if segment_right <= right:
+                del skyline[i]
+            else:
+                segment[2] = segment_right - right
+                segment[0] = right
+                break
+        # 同じ高さの隣り合う区間をまとめる
+        i = 0
+        while i < len(skyline) - 1:
+            if skyline[i][1] == skyline[i + 1][1]:
+                skyline[i][2] += skyline[i + 1][2]
+                del skyline[i + 1]
+            else:
+                i += 1
+
+def load_baked(index_filename):
+    """
+    bake.pyで書き出したイメージバンクとパレットを読み込み、画像の名前からAtlasSpriteを引く辞書を返す。
+    画像ファイルのデコードやパレットの結合は行わないため、起動時の読み込みが速くなる。
+    pyxel.initを呼び出した後に実行すること。
+
+    Args:
+        index_filename (str): bake.pyが書き出した索引ファイル (.json) のパス
+
+    Returns:
+        dict: 画像の名前 (ベイクしたフォルダからの相対パス) をキーとするAtlasSpriteの辞書
+
+    Raises:
+        ValueError: 索引ファイルの形式が正しくない場合
+    """
+    with open(index_filename, encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('version') != BAKE_VERSION:
+        raise ValueError(f"{index_filename} は対応していない形式です (バージョン: {index.get('version')})")
+
+    # リソースとパレットは索引ファイルと同じフォルダにある
+    directory = os.path.dirname(index_filename)
+    pyxel.load(os.path.join(directory, index['resource']),
+               exclude_tilemaps=True, exclude_sounds=True, exclude_musics=True)
+    pyxel.load_pal(os.path.join(directory, index['palette']))
+
+    sprites = {}
+    for name, entry in index['sprites'].items():
+        bounds = tuple(entry['bounds']) if entry['bounds'] is not None else None
+        sprites[name] = AtlasSprite(entry['bank'], entry['u'], entry['v'], entry['width'], entry['height'],
+                                    entry['transparent_color'], entry['has_transparency'], bounds)
+    return sprites
+
+class CompiledTilemap:
+    """
+    TilemapCompilerでタイルに分割した画像を表すハンドル。
+    タイルマップの矩形を1回のbltmで描画します。
+    """
+    def __init__(self, tilemap, u, v, width, height, transparent_color, has_transparency, tile_count, unique_count):
+        """
+        CompiledTilemapのコンストラクタ。
+
+        Args:
+            tilemap (int): タイルマップの番号
+            u (int): タイルマップ内のX座標 (ピクセル単位)
+            v (int): タイルマップ内のY座標 (ピクセル単位)
+            width (int): 画像の幅
+            height (int): 画像の高さ
+            transparent_color (int): 透過色のパレットインデックス
+            has_transparency (bool): 画像が透過情報を含むか
+            tile_count (int): 分割したタイルの数
+            unique_count (int): このタイルマップで新しくイメージバンクに追加したタイルの数
+        """
+        self.tilemap = tilemap
+        self.u = u
+        self.v = v
+        self.width = width
+        self.height = height
+        self.transparent_color = transparent_color
+        self.has_transparency = has_transparency
+        self.tile_count = tile_count
+        self.unique_count = unique_count
+
+    def draw(self, x, y, u=0, v=0, transparency_enabled=True):
+        """
+        タイルマップから画面に描画する。
+
+        Args:
+            x (int): 描画先のX座標
+            y (int): 描画先のY座標
+            u (int): 画像内のX座標
+            v (int): 画像内のY座標
+            transparency_enabled (bool): 透過を有効にするか
+        """
+        colkey = self.transparent_color if self.has_transparency and transparency_enabled else None
+        pyxel.bltm(x, y, self.tilemap, self.u + u, self.v + v, self.width, self.height, colkey)
+
+class TilemapCompiler:
+    """
+    大きな画像をタイルに分割し、重複しないタイルだけをイメージバンクに書き込んで
+    タイルマップで画像を組み立てるクラス。
+    同じ繰り返しのタイルでできた背景を、少ないメモリで1回のbltmで描画できるようにします。
+    複数の画像をcompileした場合も、同じタイルはイメージバンク内で共有されます。
+    """
+    def __init__(self, bank=0, tile_size=8, u=0, v=0, width=None, height=None):
+        """
+        TilemapCompilerのコンストラクタ。
+
+        Args:
+            bank (int): タイルを書き込むイメージバンクの番号
+            tile_size (int): タイルの大きさ (8または16)
+            u (int): タイルを書き込むイメージバンク内の領域のX座標 (8の倍数)
+            v (int): タイルを書き込むイメージバンク内の領域のY座標 (8の倍数)
+            width (int): タイルを書き込む領域の幅。省略した場合はイメージバンクの右端まで
+            height (int): タイルを書き込む領域の高さ。省略した場合はイメージバンクの下端まで
+
+        Raises:
+            ValueError: タイルの大きさや領域の座標が正しくない場合
+        """
+        if tile_size not in (8, 16):
+            raise ValueError(f"タイルの大きさは8または16を指定してください: {tile_size}")
+        if u % pyxel.TILE_SIZE or v % pyxel.TILE_SIZE:
+            raise ValueError(f"タイルを書き込む領域の座標は{pyxel.TILE_SIZE}の倍数を指定してください: ({u}, {v})")
+        self.bank = bank
+        self.tile_size = tile_size
+        self.u = u
+        self.v = v
+        width = width if width is not None else pyxel.IMAGE_SIZE - u
+        height = height if height is not None else pyxel.IMAGE_SIZE - v
+        self._columns = width // tile_size  # 領域に横に並べられるタイルの数
+        self.capacity = self._columns * (height // tile_size)  # 領域に書き込めるタイルの数
+        self._tiles = {}  # タイルのピクセルデータから、領域内のタイル番号を引く辞書
+
+    @property
+    def tile_count(self):
+        """イメージバンクに書き込んだタイルの数。"""
+        return len(self._tiles)
+
+    def compile(self, resource, tilemap=0, x=0, y=0):
+        """
+        画像リソースをタイルに分割し、重複しないタイルをイメージバンクに書き込んで、タイルマップに配置する。
+        画像の幅と高さがタイルの大きさで割り切れない場合、はみ出した部分は透過色で埋める。
+
+        Args:
+            resource (PyxelImageResource): 分割する画像リソース
+            tilemap (int): 配置するタイルマップの番号
+            x (int): 配置するタイルマップ内のX座標 (8ピクセル単位のセル)
+            y (int): 配置するタイルマップ内のY座標 (8ピクセル単位のセル)
+
+        Returns:
+            CompiledTilemap: タイルマップで組み立てた画像
+
+        Raises:
+            ValueError: イメージバンクの領域やタイルマップに収まらない場合
+        """
+        size = self.tile_size
+        width = resource.width
+        height = resource.height
+        columns = -(-width // size)
+        rows = -(-height // size)
+        cells = size // pyxel.TILE_SIZE  # 1つのタイルが使うセルの数 (1辺)
+        if x + columns * cells > pyxel.TILEMAP_SIZE or y + rows * cells > pyxel.TILEMAP_SIZE:
+            raise ValueError(f"{resource.filename} がタイルマップに収まりません")
+
+        # 色違いの画像は色を置き換えたピクセルデータにする
+        table = bytearray(range(256))
+        for src, dst in resource._pal_pairs:
+            table[src] = dst
+        pixels = bytes(resource.ensure_image().data_ptr()).translate(bytes(table))
+        key = bytes([resource.transparent_color])
+        padding = key * (columns * size - width)
+
+        # タイルに分割し、まだイメージバンクにないタイルに番号を振る
+        indices = []
+        new_tiles = []
+        for row in range(rows):
+            lines = []
+            for line in range(row * size, row * size + size):
+                if line < height:
+                    lines.append(pixels[line * width:(line + 1) * width] + padding)
+                else:
+                    lines.append(key * (columns * size))
+            for column in range(columns):
+                start = column * size
+                tile = b''.join(line[start:start + size] for line in lines)
+                index = self._tiles.get(tile)
+                if index is None:
+                    index = len(self._tiles)
+                    if index >= self.capacity:
+                        raise ValueError(f"{resource.filename} のタイルがイメージバンクの領域に収まりません")
+                    self._tiles[tile] = index
+                    new_tiles.append((index, tile))
+                indices.append(index)
+
+        self._write_tiles(new_tiles)
+        self._write_layout(pyxel.tilemaps[tilemap], indices, columns, rows, x, y)
+        return CompiledTilemap(tilemap, x * pyxel.TILE_SIZE, y * pyxel.TILE_SIZE, width, height,
+                               resource.transparent_color, resource.has_transparency, len(indices), len(new_tiles))
+
+    def _write_tiles(self, tiles):
+        """
+        新しいタイルをイメージバンクの領域に書き込む。
+
+        Args:
+            tiles (list): (タイル番号, ピクセルデータ) のリスト
+        """
+        size = self.tile_size
+        bank = pyxel.images[self.bank]
+        tile_image = pyxel.Image(size, size)
+        identity = bytes(range(256))
+        for index, tile in tiles:
+            PyxelImageResource._write_pixels(tile_image, tile, identity)
+            bank.blt(self.u + index % self._columns * size, self.v + index // self._columns * size,
+                     tile_image, 0, 0, size, size)
+
+    def _write_layout(self, tilemap, indices, columns, rows, x, y):
+        """
+        タイル番号の並びをタイルマップに書き込む。
+
+        Args:
+            tilemap (pyxel.Tilemap): 書き込み先のタイルマップ
+            indices (list): 行優先で並んだタイル番号のリスト
+            columns (int): 横に並ぶタイルの数
+            rows (int): 縦に並ぶタイルの数
+            x (int): 配置するタイルマップ内のX座標 (セル)
+            y (int): 配置するタイルマップ内のY座標 (セル)
+        """
+        tilemap.imgsrc = self.bank
+        cells = self.tile_size // pyxel.TILE_SIZE
+        # タイル番号から、イメージバンク内の左上のセルの座標を求める
+        base_x = self.u // pyxel.TILE_SIZE
+        base_y = self.v // pyxel.TILE_SIZE
+        origins = [
+            (base_x + index % self._columns * cells, base_y + index // self._columns * cells)
+            for index in range(len(self._tiles))
+        ]
+        data_ptr = getattr(tilemap, 'data_ptr', None)
+        data = data_ptr() if data_ptr is not None else None
+        for row in range(rows):
+            for dy in range(cells):
+                # セル1行分の (イメージバンク内のX座標, Y座標) を並べる
+                line = []
+                for index in indices[row * columns:(row + 1) * columns]:
+                    tile_x, tile_y = origins[index]
+                    for dx in range(cells):
+                        line.append((tile_x + dx, tile_y + dy))
+                cell_y = y + row * cells + dy
+                if data is not None:
+                    start = (cell_y * tilemap.width + x) * 2
+                    data[start:start + len(line) * 2] = [value for cell in line for value in cell]
+                else:
+                    # 生バッファを扱えない古いPyxel向けのフォールバック
+                    for i, cell in enumerate(line):
+                        tilemap.pset(x + i, cell_y, cell)
+
+class SpriteBatch:
+    """
+    描画する画像と配置をまとめて保持し、1回の呼び出しで描画するクラス。
+    配置と描画順は画像の追加・削除があるまで保持し、画面外の画像は描画しません。
+    """
+    def __init__(self, sort_by_source=True):
+        """
+        SpriteBatchのコンストラクタ。
+
+        Args:
+            sort_by_source (bool): Trueの場合は転送元の画像ごとにまとめて描画する。
+                重なり合う画像の前後関係は追加順ではなくなる
+        """
+        self.sort_by_source = sort_by_source
+        self._entries = []  # [画像, X座標, Y座標] のリスト
+        self._flow = None  # 自動配置の設定 (マージン, 幅)
+        self._draw_order = None  # 配置済みの描画順。画像の追加・削除でNoneに戻す
+        self.submitted = 0  # 直前のフレームで描画を要求された画像の数
+        self.culled = 0  # 直前のフレームで画面外のため描画しなかった画像の数
+        self.drawn = 0  # 直前のフレームで描画した画像の数
+
+    def add(self, sprite, x=0, y=0):
+        """
+        描画する画像を追加する。
+
+        Args:
+            sprite: PyxelImageResourceまたはAtlasSprite
+            x (int): 描画先のX座標 (自動配置を使う場合は無視される)
+            y (int): 描画先のY座標 (自動配置を使う場合は無視される)
+        """
+        self._entries.append([sprite, x, y])
+        self._draw_order = None
+
+    def remove(self, sprite):
+        """
+        描画する画像を取り除く。
+
+        Args:
+            sprite: 取り除く画像
+        """
+        self._entries = [entry for entry in self._entries if entry[0] is not sprite]
+        self._draw_order = None
+
+    def clear(self):
+        """すべての画像を取り除く。"""
+        self._entries = []
+        self._draw_order = None
+
+    def set_flow_layout(self, margin=4, width=None):
+        """
+        画像を追加した順に左から右へ並べ、幅を超えたら改行する自動配置を有効にする。
+
+        Args:
+            margin (int): 画像間と画面端のマージン
+            width (int): 配置に使う幅。省略した場合は画面の幅
+        """
+        self._flow = (margin, width)
+        self._draw_order = None
+
+    def draw(self, offset_x=0, offset_y=0, transparency_enabled=True):
+        """
+        保持している画像をまとめて描画する。
+
+        Args:
+            offset_x (int): すべての画像の描画位置に加えるX方向のずれ
+            offset_y (int): すべての画像の描画位置に加えるY方向のずれ
+            transparency_enabled (bool): 透過を有効にするか
+        """
+        if self._draw_order is None:
+            self._update_layout()
+
+        screen_width = pyxel.width
+        screen_height = pyxel.height
+        drawn = 0
+        for sprite, x, y in self._draw_order:
+            x += offset_x
+            y += offset_y
+            # 画面と重ならない画像は描画しない
+            if x >= screen_width or y >= screen_height or x + sprite.width <= 0 or y + sprite.height <= 0:
+                continue
+            sprite.draw(x, y, transparency_enabled=transparency_enabled)
+            drawn += 1
+
+        self.submitted = len(self._draw_order)
+        self.drawn = drawn
+        self.culled = self.submitted - drawn
+
+    def _update_layout(self):
+        """自動配置の位置と描画順を求め直す。"""
+        if self._flow is not None:
+            margin, width = self._flow
+            right = (width if width is not None else pyxel.width) - margin
+            x, y = margin, margin
+            row_height = 0  # 現在の行の高さ
+            for entry in self._entries:
+                sprite = entry[0]
+                # 画像が幅を超える場合は改行
+                if x + sprite.width > right:
+                    x = margin
+                    y += row_height + margin
+                    row_height = 0
+                entry[1] = x
+                entry[2] = y
+                x += sprite.width + margin
+                row_height = max(row_height, sprite.height)
+
+        order = [tuple(entry) for entry in self._entries]
+        if self.sort_by_source:
+            # 転送元の画像 (イメージバンクまたはPyxelイメージ) ごとにまとめる
+            order.sort(key=lambda entry: self._source_key(entry[0]))
+        self._draw_order = order
+
+    @staticmethod
+    def _source_key(sprite):
+        """描画順を決めるための転送元の画像を表すキーを返す静的メソッド。"""
+        if isinstance(sprite, AtlasSprite):
+            return (0, sprite.bank)
+        if isinstance(sprite, CompiledTilemap):
+            return (3, sprite.tilemap)
+        if isinstance(sprite, SpriteFrame):
+            sprite = sprite.resource
+        if isinstance(sprite, TransformedSprite):
+            return (2, id(sprite.image))
+        # 色違いの画像は元の画像とピクセルデータを共有している
+        return (1, id(sprite._base or sprite))
+
+class ImageManager:
+    """
+    複数の画像を管理し、それらのパレットを自動的に結合するクラス。
+    'with'ステートメントでの使用を想定しています。
+    """
+    def __init__(self, cache_dir=None, pixel_budget=None, profile=None, palette=None):
+        """
+        ImageManagerのコンストラクタ。
+
+        Args:
+            cache_dir (str): デコード結果のキャッシュを保存するディレクトリ。省略した場合はキャッシュしない
+            pixel_budget (int): メモリ上に保持するピクセルデータの上限 (バイト数)。
+                超えた場合は最も長く描画されていない画像から追い出す。省略した場合は上限なし
+            profile (bool): Trueの場合、画像ごとの読み込み時間と使ったパレットの数を記録する。
+                省略した場合はモジュールのDEBUGに従う
+            palette (list): 結合パレットの最初の色 (0xRRGGBB形式)。省略した場合は現在のPyxelのパレット
+        """
+        # 結合されたパレット
+        self.combined_palette = list(palette) if palette is not None else pyxel.colors.to_list()
+        self.images = {}  # 読み込んだ画像リソースを保持する辞書 (最初に読み込んだときのファイル名がキー)
+        # 正規化したファイルパスと画像ファイルの内容のハッシュから、読み込み済みの画像のキーを引く辞書
+        self._paths = {}
+        self._contents = {}
+        # 色から結合パレット内のインデックスを引く辞書 (同じ色を複数の画像で共有する)
+        self._color_slots = {}
+        for slot, color in enumerate(self.combined_palette):
+            self._color_slots.setdefault(color, slot)
+        # 透過色は不透明な色と共有できないため、別の辞書で管理する
+        self._key_slots = {}
+        # 結合パレットの各インデックスを使っている画像の数 (最初から入っている色は解放しない)
+        self._slot_refs = [1] * len(self.combined_palette)
+        self._free_slots = []  # 解放されて再利用できるインデックス (小さい順に取り出すヒープ)
+        self.quantize_error = None  # 最後に減色して読み込んだ画像セット全体の誤差 (RMSE)
+        # デコード結果のキャッシュ
+        self.decode_cache = DecodeCache(cache_dir) if cache_dir is not None else None
+        # ピクセルデータがメモリ上にある画像リソース (古く使われた順)
+        self.pixel_budget = pixel_budget
+        self._resident = OrderedDict()
+        self._resident_bytes = 0
+        # ピクセルの並び (色の置き換えを除いた構造) から、その構造を持つ元の画像リソースを引く辞書
+        self._structures = {}
+        self.hits = 0  # 描画時にピクセルデータがメモリ上にあった回数
+        self.misses = 0  # 描画時にピクセルデータを読み込み直した回数
+        self.evictions = 0  # ピクセルデータを追い出した回数
+        self._dirty = False  # パレットが変更されたかを示すフラグ
+        # 画像ごとの読み込みの統計 (記録しない場合はNone)
+        self._profile = {} if (DEBUG if profile is None else profile) else None
+
+    def load_image(self, filename):
+        """
+        画像を読み込み、パレットを管理し、PyxelImageResourceオブジェクトを返す。
+        
+        Args:
+            filename (str): 画像ファイル名
+        
+        Returns:
+            PyxelImageResource: 生成された画像リソース
+        
+        Raises:
+            ValueError: パレット数の上限を超えるなど、読み込みに失敗した場合
+        """
+        # 読み込み済みの画像 (別のパスで指定された場合も含む) は参照数を増やしてそのまま返す
+        if self._resolve(filename) is not None:
+            return self._acquire(filename)
+
+        if self.decode_cache is not None:
+            # キャッシュが有効な場合は、キャッシュに記録した内容のハッシュで照合し、ファイルは必要なときだけ読む
+            digest, decoded = _read_and_decode(filename, self.decode_cache, self._profile is not None)
+            if self._share_content(filename, digest):
+                return self._acquire(filename)
+        else:
+            # 内容が同じ画像を読み込み済みであれば、デコードせずにその画像リソースを共有する
+            data = DecodeCache._read_source(filename)
+            digest = hashlib.sha1(data).digest()
+            if self._share_content(filename, digest):
+                return self._acquire(filename)
+
+            # 画像を1回だけデコードし、パレットやピクセルデータをまとめて取得する
+            decoded = self._decode(filename, data)
+
+        # 既存の色を再利用しながら、結合パレット内の割り当て先を決める
+        color_map = self._allocate_colors(filename, decoded.palette, decoded.has_transparency)
+
+        return self._add_resource(filename, decoded, color_map, digest)
+
+    def load_images(self, filenames, max_workers=None, use_processes=False, skip_errors=False):
+        """
+        複数の画像を並列にデコードし、PyxelImageResourceオブジェクトのリストを返す。
+        デコードはスレッド (またはプロセス) プールで並列に行い、パレットの割り当てと
+        Pyxelイメージの作成はメインスレッドでfilenamesの順に行うため、
+        結果はload_imageを順番に呼び出した場合と同じになる。
+
+        Args:
+            filenames (list): 画像ファイル名のリスト
+            max_workers (int): 並列に処理するワーカー数。省略した場合はプールの既定値
+            use_processes (bool): Trueの場合はスレッドではなくプロセスでデコードする
+            skip_errors (bool): Trueの場合は読み込みに失敗した画像を警告を出して飛ばす
+
+        Returns:
+            list: 生成された画像リソースのリスト (filenamesと同じ順序)
+
+        Raises:
+            ValueError: skip_errorsがFalseで、パレット数の上限を超えるなど読み込みに失敗した場合
+        """
+        # 読み込み済みでない画像だけを、重複なくデコードする
+        pending = self._unloaded(filenames)
+        futures = dict(zip(map(_normalize_path, pending), self._decode_all(pending, max_workers, use_processes)))
+
+        resources = []
+        for filename in filenames:
+            if self._resolve(filename) is not None:
+                resources.append(self._acquire(filename))
+                continue
+            try:
+                digest, decoded = futures[_normalize_path(filename)].result()
+                if self._share_content(filename, digest):
+                    resources.append(self._acquire(filename))
+                    continue
+                color_map = self._allocate_colors(filename, decoded.palette, decoded.has_transparency)
+            except ValueError as e:
+                if not skip_errors:
+                    raise
+                warnings.warn(f"エラーのためファイルをスキップします: {e}", RuntimeWarning)
+                continue
+            resources.append(self._add_resource(filename, decoded, color_map, digest))
+        return resources
+
+    def load_images_quantized(self, filenames, max_workers=None, use_processes=False):
+        """
+        複数の画像をまとめて読み込み、パレットの上限を超える場合は減色した共有パレットで読み込む。
+        すべての画像の色が上限内に収まる場合は、load_imageと同じく色を変えずに読み込む。
+        上限を超える場合は、全画像の不透明なピクセルからメディアンカット法で共有パレットを作成し、
+        各画像の色を共有パレットの最も近い色に置き換える。
+
+        Args:
+            filenames (list): 画像ファイル名のリスト
+            max_workers (int): 並列にデコードするワーカー数。省略した場合はプールの既定値
+            use_processes (bool): Trueの場合はスレッドではなくプロセスでデコードする
+
+        Returns:
+            list: 生成された画像リソースのリスト (filenamesと同じ順序)
+
+        Raises:
+            ValueError: 画像の読み込みに失敗した場合、または透過色だけでパレットの上限を超える場合
+        """
+        # 読み込み済みでない画像だけを、重複なくデコードする
+        pending = self._unloaded(filenames)
+        decoded_list = []
+        digests = {}  # 画像ファイル名から内容のハッシュを引く辞書
+        first_of = {}  # 今回読み込む画像の内容のハッシュから、最初のファイル名を引く辞書
+        duplicates = []  # 内容が同じ画像を共有するファイル名と、共有先の内容のハッシュ
+        for filename, future in zip(pending, self._decode_all(pending, max_workers, use_processes)):
+            digest, decoded = future.result()
+            if digest in self._contents or digest in first_of:
+                duplicates.append((filename, digest))
+                continue
+            first_of[digest] = filename
+            digests[filename] = digest
+            decoded_list.append((filename, decoded))
+
+        # 追加が必要な不透明色と透過色を数える
+        new_colors = set()
+        new_keys = set()
+        for _, decoded in decoded_list:
+            for index, color in enumerate(decoded.palette):
+                if decoded.has_transparency and index == 0:
+                    if color not in self._key_slots:
+                        new_keys.add(color)
+                elif color not in self._color_slots:
+                    new_colors.add(color)
+
+        # 上限内に収まる場合は減色せずにそのまま読み込む
+        if len(new_colors) + len(new_keys) <= self._free_capacity():
+            self.quantize_error = 0.0
+            for filename, decoded in decoded_list:
+                color_map = self._allocate_colors(filename, decoded.palette, decoded.has_transparency)
+                self._add_resource(filename, decoded, color_map, digests[filename])
+            for filename, digest in duplicates:
+                self._share_content(filename, digest)
+            return self._collect_loaded(filenames, pending)
+
+        available = self._free_capacity() - len(new_keys)
+        if available < 1:
+            raise ValueError(f"透過色だけでパレットの上限{MAX_COLORS}色を超えてしまいます")
+
+        # 全画像の不透明なピクセルの色ごとの出現数を集計する
+        pixel_counts = []
+        histogram = Counter()
+        for _, decoded in decoded_list:
+            counts = Counter(decoded.pixels)
+            pixel_counts.append(counts)
+            for index, count in counts.items():
+                if not (decoded.has_transparency and index == 0):
+                    histogram[decoded.palette[index]] += count
+
+        shared_palette = self._quantize_histogram(histogram, available)
+        shared_slots = [self._color_slots.get(color) for color in shared_palette]
+        for i, color in enumerate(shared_palette):
+            if shared_slots[i] is None:
+                shared_slots[i] = self._new_slot(color, self._color_slots)
+        # 画像に割り当てるまでの間、共有パレットの色が解放されないように参照しておく
+        self._retain_slots(shared_slots)
+
+        total_error = 0
+        total_samples = 0
+        for (filename, decoded), counts in zip(decoded_list, pixel_counts):
+            if self._profile is not None:
+                start = time.perf_counter()
+                capacity = self._free_capacity()
+            # 画像の各色を共有パレットの最も近い色に対応付ける
+            nearest = self._map_to_palette(decoded.palette, shared_palette)
+            color_map = [shared_slots[i] for i in nearest]
+            if decoded.has_transparency:
+                key_color = decoded.palette[0]
+                key_slot = self._key_slots.get(key_color)
+                if key_slot is None:
+                    key_slot = self._new_slot(key_color, self._key_slots)
+                color_map[0] = key_slot
+            self._retain_slots(color_map)
+            if self._profile is not None:
+                # 共有パレットの色は画像ごとに数えず、透過色の分だけを数える
+                self._record(filename, 'merge_ms', (time.perf_counter() - start) * 1000)
+                self._record(filename, 'slots', capacity - self._free_capacity())
+
+            # 不透明なピクセルについて、元の色と置き換えた色の二乗誤差を集計する
+            error = 0
+            samples = 0
+            for index, count in counts.items():
+                if decoded.has_transparency and index == 0:
+                    continue
+                error += count * self._color_distance(decoded.palette[index], shared_palette[nearest[index]])
+                samples += count * 3
+
+            resource = self._add_resource(filename, decoded, color_map, digests[filename])
+            resource.quantize_error = math.sqrt(error / samples) if samples else 0.0
+            total_error += error
+            total_samples += samples
+
+        # どの画像からも使われなかった共有パレットの色は解放する
+        self._release_slots(set(shared_slots))
+
+        for filename, digest in duplicates:
+            self._share_content(filename, digest)
+        self.quantize_error = math.sqrt(total_error / total_samples) if total_samples else 0.0
+        return self._collect_loaded(filenames, pending)
+
+    def unload(self, target):
+        """
+        画像リソースの参照を1つ解放する。参照がなくなった場合はピクセルデータと
+        パレットの割り当てを解放し、マネージャーから取り除く。
+
+        Args:
+            target: 画像ファイル名 (読み込んだときと別のパスでもよい)、またはPyxelImageResourceオブジェクト
+
+        Returns:
+            bool: 画像リソースが取り除かれた場合はTrue
+
+        Raises:
+            KeyError: 読み込まれていない画像が指定された場合
+        """
+        filename = target.filename if isinstance(target, PyxelImageResource) else self._resolve(target)
+        if filename is None:
+            raise KeyError(target)
+        resource = self.images[filename]
+        resource.ref_count -= 1
+        if resource.ref_count > 0:
+            return False
+
+        # 参照がなくなったのでパレットの割り当てとピクセルデータを解放する
+        self._release_slots(set(resource.color_map))
+        del self.images[filename]
+        # この画像を指していたパスと内容のハッシュの登録を取り除く
+        for path in [path for path, key in self._paths.items() if key == filename]:
+            del self._paths[path]
+        if self._contents.get(resource._digest) == filename:
+            del self._contents[resource._digest]
+        if self._resident.pop(filename, None) is not None:
+            self._resident_bytes -= resource.width * resource.height
+        if resource._base is not None:
+            # 色違いの画像は、共有していた元の画像の参照を解放する
+            self.unload(resource._base)
+        elif self._structures.get(resource._structure) is resource:
+            del self._structures[resource._structure]
+        resource.image = None
+        resource._manager = None
+        return True
+
+    def reload(self, target):
+        """
+        画像ファイルを読み込み直し、画像リソースをその場で更新する (ホットリロード)。
+        同じPyxelImageResourceオブジェクトのまま内容が変わるため、参照している側の変更は不要。
+        変更前と同じ色は同じパレットのインデックスを使い続け、使われなくなった色だけを解放する。
+        アトラスやVariantCacheの変換済みの画像は更新されないため、必要に応じて作り直すこと。
+
+        Args:
+            target: 画像ファイル名 (読み込んだときと別のパスでもよい)、またはPyxelImageResourceオブジェクト
+
+        内容が同じ別のファイルと画像リソースを共有している場合は、共有をやめる。
+        共有していたファイルを指定した場合は、そのファイルを新しい画像リソースとして読み込み直し、
+        共有先のファイルを指定した場合は、共有していたファイルの次回の読み込みで新しい画像リソースが作られる。
+
+        Returns:
+            PyxelImageResource: 更新した画像リソース (共有していたファイルを指定した場合は新しい画像リソース)
+
+        Raises:
+            KeyError: 読み込まれていない画像が指定された場合
+            ValueError: 新しい色を追加するとパレットの上限を超える場合 (画像リソースは変更されない)
+        """
+        filename = target.filename if isinstance(target, PyxelImageResource) else self._resolve(target)
+        if filename is None:
+            raise KeyError(target)
+        if not isinstance(target, PyxelImageResource) and _normalize_path(target) != _normalize_path(filename):
+            # 内容が同じ別のファイルを共有していたので、共有をやめて新しく読み込む
+            del self._paths[_normalize_path(target)]
+            self.unload(filename)
+            return self.load_image(target)
+        resource = self.images[filename]
+        digest, decoded = _read_and_decode(filename, self.decode_cache, self._profile is not None)
+
+        # 新しい色を割り当ててから古い割り当てを解放し、共通の色のインデックスを変えない
+        color_map = self._allocate_colors(filename, decoded.palette, decoded.has_transparency)
+        self._release_slots(set(resource.color_map))
+
+        # この画像のピクセルデータを共有している色違いの画像は、それぞれのファイルから読み込み直して切り離す
+        for other in [other for other in self.images.values() if other._base is resource]:
+            self._detach(other)
+        if resource._base is not None:
+            base = resource._base
+            resource._base = None
+            self.unload(base)
+        elif self._structures.get(resource._structure) is resource:
+            del self._structures[resource._structure]
+        if self._contents.get(resource._digest) == filename:
+            del self._contents[resource._digest]
+        # 内容が同じだった別のファイルのパスは、このファイルと共有しないようにする
+        own_path = _normalize_path(filename)
+        for path in [path for path, key in self._paths.items() if key == filename and path != own_path]:
+            del self._paths[path]
+
+        old_bytes = resource.width * resource.height if filename in self._resident else 0
+        resource._width = decoded.width
+        resource._height = decoded.height
+        resource.has_transparency = decoded.has_transparency
+        resource.palette = list(decoded.palette)
+        resource.color_map = color_map
+        resource.transparent_color = color_map[0]
+        resource.bounds = resource._find_bounds(decoded)
+        resource._spans = None
+        resource.collision_mask = CollisionMask.from_pixels(decoded.width, decoded.height, decoded.pixels,
+                                                            decoded.has_transparency)
+        resource._pal_pairs = []
+        resource._source_key = resource.transparent_color
+        resource._restore(decoded)
+
+        structure = (decoded.width, decoded.height, decoded.has_transparency,
+                     hashlib.sha1(decoded.pixels).digest())
+        resource._structure = structure
+        self._structures.setdefault(structure, resource)
+        resource._digest = digest
+        self._contents.setdefault(digest, filename)
+
+        self._resident[filename] = resource
+        self._resident.move_to_end(filename)
+        self._resident_bytes += resource.width * resource.height - old_bytes
+        self._enforce_budget()
+        self._dirty = True
+        return resource
+
+    def _detach(self, resource):
+        """
+        元の画像とピクセルデータを共有している色違いの画像を、自分のファイルから読み込み直して切り離す。
+
+        Args:
+            resource (PyxelImageResource): 色違いの画像リソース
+        """
+        base = resource._base
+        resource._restore(self._decode(resource.filename))
+        resource._base = None
+        resource._pal_pairs = []
+        resource._source_key = resource.transparent_color
+        base.ref_count -= 1
+        # 元の画像の代わりに、同じ構造の画像の共有元になる
+        if self._structures.get(base._structure) is base:
+            self._structures[base._structure] = resource
+            resource._structure = base._structure
+        self._resident[resource.filename] = resource
+        self._resident_bytes += resource.width * resource.height
+        self._enforce_budget()
+
+    def cache_stats(self):
+        """
+        ピクセルデータのキャッシュの統計を返す。
+
+        Returns:
+            dict: ヒット数、ミス数、追い出し数、メモリ上の画像数とバイト数、上限
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'resident_images': len(self._resident),
+            'resident_bytes': self._resident_bytes,
+            'pixel_budget': self.pixel_budget,
+        }
+
+    def load_sprite_sheet(self, filename, frame_width=None, frame_height=None, margin=0, spacing=0, rects=None):
+        """
+        画像をスプライトシートとして読み込む。
+
+        Args:
+            filename (str): 画像ファイル名
+            frame_width (int): 格子状に切り分ける場合のフレームの幅
+            frame_height (int): 格子状に切り分ける場合のフレームの高さ。省略した場合はframe_widthと同じ
+            margin (int): 格子状に切り分ける場合のシートの端からの余白
+            spacing (int): 格子状に切り分ける場合のフレーム間の間隔
+            rects (dict): フレーム名から矩形 (u, v, 幅, 高さ) を引く辞書。格子の後に追加される
+
+        Returns:
+            SpriteSheet: 読み込んだスプライトシート
+
+        Raises:
+            ValueError: パレット数の上限を超えるなど、読み込みに失敗した場合
+        """
+        sheet = SpriteSheet(self.load_image(filename))
+        if frame_width is not None:
+            sheet.slice_grid(frame_width, frame_height or frame_width, margin, spacing)
+        for name, rect in (rects or {}).items():
+            sheet.define(name, *rect)
+        return sheet
+
+    def load_tilemap(self, filename, compiler=None, tilemap=0, x=0, y=0, keep_image=False):
+        """
+        画像を読み込み、TilemapCompilerでタイルに分割してタイルマップに配置する。
+        パレットは通常の画像と同じように割り当てられ、画像をアンロードするまで保持される。
+
+        Args:
+            filename (str): 画像ファイル名
+            compiler (TilemapCompiler): タイルを書き込むTilemapCompiler。省略した場合はイメージバンク0に8x8のタイルで書き込む
+            tilemap (int): 配置するタイルマップの番号
+            x (int): 配置するタイルマップ内のX座標 (8ピクセル単位のセル)
+            y (int): 配置するタイルマップ内のY座標 (8ピクセル単位のセル)
+            keep_image (bool): Falseの場合、タイルに分割した後は画像リソースのピクセルデータをメモリから追い出す
+
+        Returns:
+            CompiledTilemap: タイルマップで組み立てた画像
+
+        Raises:
+            ValueError: パレット数の上限を超える場合、またはイメージバンクやタイルマップに収まらない場合
+        """
+        resource = self.load_image(filename)
+        compiled = (compiler or TilemapCompiler()).compile(resource, tilemap, x, y)
+        if not keep_image:
+            # 描画にはタイルマップを使うため、元の画像のピクセルデータは不要
+            self._release_image(resource)
+        return compiled
+
+    def _release_image(self, resource):
+        """
+        画像リソースのピクセルデータをメモリから追い出す。パレットの割り当てと参照数は変えない。
+        追い出した画像リソースを描画した場合は読み込み直される。
+
+        Args:
+            resource (PyxelImageResource): 画像リソース
+        """
+        if resource._base is not None or resource.image is None:
+            return
+        if self._resident.pop(resource.filename, None) is not None:
+            self._resident_bytes -= resource.width * resource.height
+        resource.image = None
+
+    def stats(self):
+        """
+        読み込んだ画像ごとの統計を返す。
+        時間とパレットの数は、統計を記録している (profile=True) 場合のみ値が入り、それ以外はNoneになる。
+
+        Returns:
+            dict: 'files' (画像ファイル名から統計を引く辞書) と 'totals' (全体の合計) を持つ辞書。
+                各画像の統計は decode_ms (デコード時間)、merge_ms (パレットの割り当て時間)、
+                remap_ms (Pyxelイメージの作成時間)、slots (新しく使ったパレットの数)、
+                pixel_bytes (メモリ上に保持しているピクセルデータのバイト数)、colors (色数)、
+                has_transparency (透過情報を含むか) を持つ
+        """
+        names = ('decode_ms', 'merge_ms', 'remap_ms', 'slots')
+        files = {}
+        for filename, resource in self.images.items():
+            entry = dict.fromkeys(names)
+            if self._profile is not None:
+                entry.update(self._profile.get(filename, {}))
+            # 色違いの画像は元の画像のピクセルデータを共有しているため数えない
+            owns_pixels = resource._base is None and resource.image is not None
+            entry['pixel_bytes'] = resource.width * resource.height if owns_pixels else 0
+            entry['colors'] = len(resource.palette)
+            entry['has_transparency'] = resource.has_transparency
+            files[filename] = entry
+
+        totals = {'files': len(files), 'pixel_bytes': sum(entry['pixel_bytes'] for entry in files.values())}
+        for name in names:
+            totals[name] = None if self._profile is None else sum(entry[name] or 0 for entry in files.values())
+        totals['palette_used'] = len(self.combined_palette) - len(self._free_slots)
+        return {'files': files, 'totals': totals}
+
+    def print_stats(self, file=None):
+        """
+        読み込んだ画像ごとの統計を、読み込みに時間がかかった順に表形式で出力する。
+
+        Args:
+            file: 出力先のファイルオブジェクト。省略した場合は標準出力
+        """
+        file = file if file is not None else sys.stdout
+        stats = self.stats()
+
+        def ms(value):
+            return f"{value:8.2f}" if value is not None else f"{'-':>8}"
+
+        def total_time(item):
+            entry = item[1]
+            return sum(entry[name] or 0 for name in ('decode_ms', 'merge_ms', 'remap_ms'))
+
+        print(f"{'decode':>8} {'merge':>8} {'remap':>8} {'slots':>5} {'bytes':>8} {'colors':>6}  ファイル", file=file)
+        for filename, entry in sorted(stats['files'].items(), key=total_time, reverse=True):
+            slots = entry['slots'] if entry['slots'] is not None else '-'
+            key = ' (透過)' if entry['has_transparency'] else ''
+            print(f"{ms(entry['decode_ms'])} {ms(entry['merge_ms'])} {ms(entry['remap_ms'])} {slots:>5} "
+                  f"{entry['pixel_bytes']:>8} {entry['colors']:>6}  {filename}{key}", file=file)
+        totals = stats['totals']
+        slots = totals['slots'] if totals['slots'] is not None else '-'
+        print(f"{ms(totals['decode_ms'])} {ms(totals['merge_ms'])} {ms(totals['remap_ms'])} {slots:>5} "
+              f"{totals['pixel_bytes']:>8} {'':>6}  合計 {totals['files']}ファイル "
+              f"(パレット使用数: {totals['palette_used']}/{MAX_COLORS})", file=file)
+
+    def _record(self, filename, name, value):
+        """
+        画像の統計に値を加算する。統計を記録していない場合は呼び出さないこと。
+
+        Args:
+            filename (str): 画像ファイル名
+            name (str): 統計の名前
+            value: 加算する値
+        """
+        entry = self._profile.setdefault(filename, {})
+        entry[name] = entry.get(name, 0) + value
+
+    def _decode(self, filename, data=None):
+        """
+        画像をデコードする。キャッシュが有効な場合はキャッシュを経由する。
+
+        Args:
+            filename (str): 画像ファイル名
+            data (bytes): 読み込み済みの画像ファイルの内容。省略した場合はファイルから読み込む
+
+        Returns:
+            DecodedImage: デコード結果
+        """
+        if self._profile is not None:
+            start = time.perf_counter()
+        if self.decode_cache is not None:
+            decoded = self.decode_cache.load(filename, data)
+        else:
+            decoded = DecodedImage.from_file(filename, data)
+        if self._profile is not None:
+            decoded.decode_time = time.perf_counter() - start
+        return decoded
+
+    def _decode_all(self, filenames, max_workers=None, use_processes=False):
+        """
+        複数の画像をスレッド (またはプロセス) プールで並列にデコードする。
+
+        Args:
+            filenames (list): 画像ファイル名のリスト
+            max_workers (int): 並列に処理するワーカー数。省略した場合はプールの既定値
+            use_processes (bool): Trueの場合はスレッドではなくプロセスでデコードする
+
+        Returns:
+            list: filenamesと同じ順序の、(画像ファイルの内容のハッシュ, DecodedImage) を結果に持つFutureのリスト
+        """
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        timed = self._profile is not None
+        with executor_class(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_read_and_decode, filename, self.decode_cache, timed)
+                for filename in filenames
+            ]
+
+        # プロセスでは複製したキャッシュの回数が更新されるため、結果からメインプロセスの回数に数え直す
+        if use_processes and self.decode_cache is not None:
+            for future in futures:
+                if future.exception() is None:
+                    if future.result()[1].cache_hit:
+                        self.decode_cache.hits += 1
+                    else:
+                        self.decode_cache.misses += 1
+        return futures
+
+    def _add_resource(self, filename, decoded, color_map, digest=None):
+        """
+        デコード済みの画像から画像リソースを作成し、マネージャーに追加する。
+
+        Args:
+            filename (str): 画像ファイル名
+            decoded (DecodedImage): デコード済みの画像
+            color_map (list): 画像の各色インデックスに対応する結合パレット内のインデックス
+            digest (bytes): 画像ファイルの内容のハッシュ。指定した場合は同じ内容の画像の読み込みで共有する
+
+        Returns:
+            PyxelImageResource: 生成された画像リソース
+        """
+        if self._profile is not None:
+            start = time.perf_counter()
+            resource = self._create_resource(filename, decoded, color_map)
+            self._record(filename, 'remap_ms', (time.perf_counter() - start) * 1000)
+            if decoded.decode_time is not None:
+                self._record(filename, 'decode_ms', decoded.decode_time * 1000)
+        else:
+            resource = self._create_resource(filename, decoded, color_map)
+        self._paths[_normalize_path(filename)] = filename
+        resource._digest = digest
+        if digest is not None:
+            self._contents.setdefault(digest, filename)
+        return resource
+
+    def _create_resource(self, filename, decoded, color_map):
+        """
+        デコード済みの画像から画像リソースを作成し、マネージャーに追加する (_add_resourceの本体)。
+
+        Args:
+            filename (str): 画像ファイル名
+            decoded (DecodedImage): デコード済みの画像
+            color_map (list): 画像の各色インデックスに対応する結合パレット内のインデックス
+
+        Returns:
+            PyxelImageResource: 生成された画像リソース
+        """
+        # 色インデックスは最初に現れた順に振られているため、色違いの画像はピクセルデータが一致する
+        structure = (decoded.width, decoded.height, decoded.has_transparency,
+                     hashlib.sha1(decoded.pixels).digest())
+        base = self._structures.get(structure)
+        if base is not None and self._can_recolor(base.color_map, color_map):
+            # 色違いの画像は元の画像のピクセルデータを共有し、元の画像の参照数を増やす
+            resource = PyxelImageResource(filename, decoded=decoded, color_map=color_map, base=base)
+            base.ref_count += 1
+        else:
+            resource = PyxelImageResource(filename, decoded=decoded, color_map=color_map)
+            self._structures.setdefault(structure, resource)
+            resource._structure = structure
+            self._resident[filename] = resource
+            self._resident_bytes += resource.width * resource.height
+            self._enforce_budget()
+        resource._manager = self
+        self.images[filename] = resource
+        self._dirty = True
+        return resource
+
+    @staticmethod
+    def _can_recolor(base_map, color_map):
+        """
+        元の画像のピクセルデータを、パレットの置き換えだけで色違いの画像として描画できるか判定する静的メソッド。
+        減色などで元の画像の複数の色が同じスロットに割り当てられている場合、
+        そのスロットを色違いの画像の異なる色に置き換えられないため共有できない。
+
+        Args:
+            base_map (list): 元の画像のcolor_map
+            color_map (list): 色違いの画像のcolor_map
+
+        Returns:
+            bool: 共有できる場合はTrue
+        """
+        targets = {}
+        for src, dst in zip(base_map, color_map):
+            if targets.setdefault(src, dst) != dst:
+                return False
+        return True
+
+    def _acquire(self, filename):
+        """
+        読み込み済みの画像リソースの参照数を増やして返す。
+
+        Args:
+            filename (str): 画像ファイル名 (読み込んだときと別のパスでもよい)
+
+        Returns:
+            PyxelImageResource: 画像リソース
+        """
+        resource = self.images[self._resolve(filename)]
+        resource.ref_count += 1
+        return resource
+
+    def _resolve(self, filename):
+        """
+        ファイル名から読み込み済みの画像のキー (最初に読み込んだときのファイル名) を求める。
+        別のパスで同じファイルを指定した場合や、内容が同じ別のファイルを読み込み済みの場合も見つかる。
+
+        Args:
+            filename (str): 画像ファイル名
+
+        Returns:
+            str: 読み込み済みの画像のキー。読み込まれていない場合はNone
+        """
+        if filename in self.images:
+            return filename
+        return self._paths.get(_normalize_path(filename))
+
+    def _unloaded(self, filenames):
+        """
+        読み込み済みでない画像のファイル名を、同じファイルを指すパスの重複を除いて返す。
+
+        Args:
+            filenames (list): 画像ファイル名のリスト
+
+        Returns:
+            list: 同じファイルを指すパスのうち最初に現れたファイル名のリスト (filenamesと同じ順序)
+        """
+        unloaded = {}
+        for filename in filenames:
+            if self._resolve(filename) is None:
+                unloaded.setdefault(_normalize_path(filename), filename)
+        return list(unloaded.values())
+
+    def _share_content(self, filename, digest):
+        """
+        内容が同じ画像を読み込み済みであれば、ファイル名をその画像に対応付ける。
+
+        Args:
+            filename (str): 画像ファイル名
+            digest (bytes): 画像ファイルの内容のハッシュ
+
+        Returns:
+            bool: 対応付けた場合はTrue
+        """
+        key = self._contents.get(digest)
+        if key is None:
+            return False
+        self._paths[_normalize_path(filename)] = key
+        return True
+
+    def _collect_loaded(self, filenames, loaded):
+        """
+        まとめて読み込んだ画像リソースをfilenamesの順に並べる。
+        新しく読み込んだ画像の最初の出現以外は、参照数を増やして返す。
+
+        Args:
+            filenames (list): 要求された画像ファイル名のリスト
+            loaded (list): 今回新しく読み込んだ画像ファイル名のリスト
+
+        Returns:
+            list: 画像リソースのリスト (filenamesと同じ順序)
+        """
+        first_use = set(filename for filename in loaded if filename in self.images)
+        resources = []
+        for filename in filenames:
+            if filename in first_use:
+                first_use.discard(filename)
+                resources.append(self.images[filename])
+            else:
+                resources.append(self._acquire(filename))
+        return resources
+
+    def _touch(self, resource):
+        """
+        描画される画像リソースを最近使ったものとして記録する。
+        ピクセルデータが追い出されている場合は読み込み直す。
+
+        Args:
+            resource (PyxelImageResource): 描画される画像リソース
+        """
+        filename = resource.filename
+        if resource.image is not None:
+            self.hits += 1
+            self._resident.move_to_end(filename)
+            return
+
+        # 追い出されたピクセルデータを、同じパレットの割り当てで読み込み直す
+        self.misses += 1
+        resource._restore(self._decode(filename))
+        self._resident[filename] = resource
+        self._resident_bytes += resource.width * resource.height
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        """ピクセルデータの合計が上限を超えている間、最も長く使われていない画像から追い出す。"""
+        if self.pixel_budget is None:
+            return
+        # 直前に使われた画像は、上限を超えていても追い出さない
+        while self._resident_bytes > self.pixel_budget and len(self._resident) > 1:
+            _, resource = self._resident.popitem(last=False)
+            self._resident_bytes -= resource.width * resource.height
+            resource.image = None
+            self.evictions += 1
+
+    @staticmethod
+    def _quantize_histogram(histogram, max_colors):
+        """
+        色ごとの出現数から、メディアンカット法で最大max_colors色のパレットを作成する静的メソッド。
+
+        Args:
+            histogram (Counter): 0xRRGGBB形式の色をキーとする出現数
+            max_colors (int): パレットの最大色数
+
+        Returns:
+            list: 0xRRGGBB形式の色のリスト
+        """
+        # 出現数の分だけ色を並べた1行の画像を作り、PILのメディアンカットで一括して減色する
+        samples = b''.join(color.to_bytes(3, 'big') * count for color, count in histogram.items())
+        samples_img = Image.frombytes('RGB', (len(samples) // 3, 1), samples)
+        quantized = samples_img.quantize(colors=max_colors, method=Image.Quantize.MEDIANCUT,
+                                         dither=Image.Dither.NONE)
+        flat_palette = quantized.getpalette()
+        used = sorted(index for _, index in quantized.getcolors(256))
+        return [
+            (flat_palette[i * 3] << 16) | (flat_palette[i * 3 + 1] << 8) | flat_palette[i * 3 + 2]
+            for i in used
+        ]
+
+    @staticmethod
+    def _map_to_palette(colors, palette):
+        """
+        各色を、パレットの中で最も近い色のインデックスに対応付ける静的メソッド。
+
+        Args:
+            colors (list): 0xRRGGBB形式の対応付ける色のリスト
+            palette (list): 0xRRGGBB形式の対応付け先のパレット
+
+        Returns:
+            list: colorsの各色に対応するpaletteのインデックス
+        """
+        flat_palette = b''.join(color.to_bytes(3, 'big') for color in palette)
+        flat_palette += palette[0].to_bytes(3, 'big') * (256 - len(palette))
+        palette_img = Image.new('P', (1, 1))
+        palette_img.putpalette(flat_palette)
+        colors_img = Image.frombytes('RGB', (len(colors), 1), b''.join(color.to_bytes(3, 'big') for color in colors))
+        return list(colors_img.quantize(palette=palette_img, dither=Image.Dither.NONE).tobytes())
+
+    @staticmethod
+    def _color_distance(color1, color2):
+        """
+        2つの色のRGB各成分の差の二乗和を返す静的メソッド。
+
+        Args:
+            color1 (int): 0xRRGGBB形式の色
+            color2 (int): 0xRRGGBB形式の色
+
+        Returns:
+            int: 各成分の差の二乗和
+        """
+        dr = (color1 >> 16) - (color2 >> 16)
+        dg = ((color1 >> 8) & 0xFF) - ((color2 >> 8) & 0xFF)
+        db = (color1 & 0xFF) - (color2 & 0xFF)
+        return dr * dr + dg * dg + db * db
+
+    def _allocate_colors(self, filename, palette, has_transparency):
+        """
+        画像のパレットの各色に結合パレット内のインデックスを割り当てる。
+        すでに結合パレットにある色はそのインデックスを再利用し、新しい色だけを追加する。
+        透過画像の最初の色 (透過色) は、不透明な色とは別のインデックスを使う。
+
+        Args:
+            filename (str): 画像ファイル名 (エラーメッセージ用)
+            palette (list): 画像のパレット
+            has_transparency (bool): 画像が透過情報を含むか
+
+        Returns:
+            list: 画像の各色インデックスに対応する結合パレット内のインデックス
+
+        Raises:
+            ValueError: 新しい色を追加するとパレットの上限を超える場合
+        """
+        if self._profile is not None:
+            start = time.perf_counter()
+            capacity = self._free_capacity()
+            color_map = self._assign_colors(filename, palette, has_transparency)
+            self._record(filename, 'merge_ms', (time.perf_counter() - start) * 1000)
+            self._record(filename, 'slots', capacity - self._free_capacity())
+            return color_map
+        return self._assign_colors(filename, palette, has_transparency)
+
+    def _assign_colors(self, filename, palette, has_transparency):
+        """
+        画像のパレットの各色に結合パレット内のインデックスを割り当てる (_allocate_colorsの本体)。
+
+        Args:
+            filename (str): 画像ファイル名 (エラーメッセージ用)
+            palette (list): 画像のパレット
+            has_transparency (bool): 画像が透過情報を含むか
+
+        Returns:
+            list: 画像の各色インデックスに対応する結合パレット内のインデックス
+
+        Raises:
+            ValueError: 新しい色を追加するとパレットの上限を超える場合
+        """
+        # 追加が必要な色を先に数え、上限を超える場合は何も変更せずにエラーにする
+        lookups = [
+            self._key_slots if has_transparency and index == 0 else self._color_slots
+            for index in range(len(palette))
+        ]
+        new_count = sum(1 for color, slots in zip(palette, lookups) if color not in slots)
+        if new_count > self._free_capacity():
+            raise ValueError(f"{filename} を追加するとパレットの上限{MAX_COLORS}色を超えてしまいます")
+
+        color_map = []
+        for color, slots in zip(palette, lookups):
+            slot = slots.get(color)
+            if slot is None:
+                slot = self._new_slot(color, slots)
+            color_map.append(slot)
+        self._retain_slots(color_map)
+        return color_map
+
+    def _free_capacity(self):
+        """結合パレットに新しく割り当てられる色の数を返す。"""
+        return MAX_COLORS - len(self.combined_palette) + len(self._free_slots)
+
+    def _new_slot(self, color, slots):
+        """
+        結合パレットに新しいインデックスを割り当てる。解放されたインデックスがあればそれを再利用する。
+
+        Args:
+            color (int): 0xRRGGBB形式の色
+            slots (dict): 割り当てたインデックスを登録する辞書 (不透明色用または透過色用)
+
+        Returns:
+            int: 割り当てたインデックス
+        """
+        if self._free_slots:
+            slot = heapq.heappop(self._free_slots)
+            self.combined_palette[slot] = color
+        else:
+            slot = len(self.combined_palette)
+            self.combined_palette.append(color)
+            self._slot_refs.append(0)
+        slots[color] = slot
+        self._dirty = True
+        return slot
+
+    def _retain_slots(self, color_map):
+        """画像が使う結合パレットのインデックスの参照数を増やす。"""
+        for slot in set(color_map):
+            self._slot_refs[slot] += 1
+
+    def _release_slots(self, slots):
+        """
+        結合パレットのインデックスの参照数を減らし、使われなくなったインデックスを解放する。
+
+        Args:
+            slots (set): 参照数を減らすインデックスの集合
+        """
+        for slot in slots:
+            self._slot_refs[slot] -= 1
+            if self._slot_refs[slot] > 0:
+                continue
+            color = self.combined_palette[slot]
+            for lookup in (self._color_slots, self._key_slots):
+                if lookup.get(color) == slot:
+                    del lookup[color]
+            heapq.heappush(self._free_slots, slot)
+
+    def build_atlas(self, banks=None, release_images=True):
+        """
+        読み込んだすべての画像リソースをイメージバンクに詰め込む。
+
+        Args:
+            banks (list): 使用するイメージバンクの番号のリスト。省略した場合はすべてのイメージバンクを使う
+            release_images (bool): Trueの場合、詰め込んだ後は画像リソースのピクセルデータをメモリから追い出す。
+                パレットの割り当ては保持されるため、AtlasSpriteはそのまま描画できる
+
+        Returns:
+            dict: 画像ファイル名をキーとするAtlasSpriteの辞書
+
+        Raises:
+            ValueError: イメージバンクに収まらない画像がある場合
+        """
+        builder = AtlasBuilder(banks)
+        for filename, resource in self.images.items():
+            builder.add(filename, resource)
+        sprites = builder.build()
+        if release_images:
+            for resource in self.images.values():
+                self._release_image(resource)
+        return sprites
+
+    def apply_palette_to_pyxel(self):
+        """最終的に結合されたパレットをPyxelに適用する。"""
+        if self._dirty:
+            pyxel.colors.from_list(self.combined_palette)
+            self._dirty = False
+
+    def __enter__(self):
+        """'with'ステートメントの開始時に呼び出される。"""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """'with'ステートメントの終了時に呼び出され、パレットを適用する。"""
+        self.apply_palette_to_pyxel()
+        if DEBUG:
+            self.print_stats()
+
+    def __del__(self):
+        """インスタンス破棄時の処理。"""
+        # インスタンス破棄時に_dirtyフラグがTrueなら、パレットが適用されていない
+        if self._dirty:
+            warnings.warn(
+                "ImageManagerが正しく終了されませんでした。"
+                "'with'ステートメントを使用してパレットが適用されるようにしてください。",
+                ResourceWarning
+            )
+
+class PalettePages:
+    """
+    名前を付けた複数のパレット (ページ) で画像を管理するクラス。
+    ページごとにImageManagerを持ち、それぞれが最大255色のパレットを使えます。
+    ページを切り替えるとPyxelのパレットを1回で置き換えるため、画像を読み込み直す必要はありません。
+    画像は、その画像を読み込んだページが選ばれているときに描画してください。
+    """
+    def __init__(self, cache_dir=None, pixel_budget=None, profile=None, palette=None):
+        """
+        PalettePagesのコンストラクタ。引数は各ページのImageManagerにそのまま渡される。
+
+        Args:
+            cache_dir (str): デコード結果のキャッシュを保存するディレクトリ。省略した場合はキャッシュしない
+            pixel_budget (int): ページごとにメモリ上に保持するピクセルデータの上限 (バイト数)
+            profile (bool): Trueの場合、ページごとに読み込みの統計を記録する
+            palette (list): 各ページのパレットの最初の色。省略した場合はPyxelの既定の16色
+        """
+        self.palette = list(palette) if palette is not None else list(pyxel.DEFAULT_COLORS)
+        self._options = {'cache_dir': cache_dir, 'pixel_budget': pixel_budget, 'profile': profile}
+        self.pages = OrderedDict()  # ページ名からImageManagerを引く辞書 (作成順)
+        self.current = None  # 現在Pyxelに適用されているページ名
+        self._page_of = {}  # 画像ファイル名から読み込んだページ名を引く辞書
+
+    def page(self, name):
+        """
+        ページのImageManagerを返す。ページがない場合は作成する。
+
+        Args:
+            name (str): ページ名
+
+        Returns:
+            ImageManager: ページの画像を管理するImageManager
+        """
+        manager = self.pages.get(name)
+        if manager is None:
+            manager = ImageManager(palette=self.palette, **self._options)
+            self.pages[name] = manager
+        return manager
+
+    def page_of(self, filename):
+        """
+        画像を読み込んだページ名を返す。
+
+        Args:
+            filename (str): 画像ファイル名
+
+        Returns:
+            str: ページ名。読み込まれていない場合はNone
+        """
+        return self._page_of.get(filename)
+
+    def load_image(self, name, filename):
+        """
+        画像をページに読み込む。
+
+        Args:
+            name (str): ページ名
+            filename (str): 画像ファイル名
+
+        Returns:
+            PyxelImageResource: 生成された画像リソース
+
+        Raises:
+            ValueError: ページのパレットの上限を超えるなど、読み込みに失敗した場合
+        """
+        resource = self.page(name).load_image(filename)
+        self._page_of[filename] = name
+        self._commit(name)
+        return resource
+
+    def load_images(self, name, filenames, max_workers=None, use_processes=False, skip_errors=False):
+        """
+        複数の画像をページに読み込む。引数はImageManager.load_imagesと同じ。
+
+        Args:
+            name (str): ページ名
+            filenames (list): 画像ファイル名のリスト
+            max_workers (int): 並列に処理するワーカー数。省略した場合はプールの既定値
+            use_processes (bool): Trueの場合はスレッドではなくプロセスでデコードする
+            skip_errors (bool): Trueの場合は読み込みに失敗した画像を警告を出して飛ばす
+
+        Returns:
+            list: 生成された画像リソースのリスト
+        """
+        manager = self.page(name)
+        resources = manager.load_images(filenames, max_workers, use_processes, skip_errors)
+        for resource in resources:
+            self._page_of[resource.filename] = name
+        self._commit(name)
+        return resources
+
+    def load_planned(self, filenames, prefix='page', max_workers=None):
+        """
+        plan_pagesで求めたできるだけ少ないページに、複数の画像を振り分けて読み込む。
+        prefixの後に番号を付けた名前の既存のページに空きがあればそこに入れ、足りない場合は
+        まだ使われていない番号で新しいページを作る。読み込み済みの画像と、読み込み済みの画像と
+        内容が同じ画像は、読み込んだページの画像リソースの参照数を増やして返す。
+        パレットの上限を超える場合は、どのページも変更せずに例外を送出する。
+
+        Args:
+            filenames (list): 画像ファイル名のリスト
+            prefix (str): 振り分け先のページ名の接頭辞
+            max_workers (int): 並列にデコードするワーカー数。省略した場合はプールの既定値
+
+        Returns:
+            dict: 画像ファイル名から (ページ名, PyxelImageResource) を引く辞書
+
+        Raises:
+            ValueError: 画像を読み込めない場合、または1枚だけでページのパレットの上限を超える画像がある場合
+        """
+        filenames = list(dict.fromkeys(filenames))
+        pending = {}  # 正規化したファイルパスから、読み込み済みでない画像の最初のファイル名を引く辞書
+        for filename in filenames:
+            if self._find_page(filename) is None:
+                pending.setdefault(_normalize_path(filename), filename)
+        pending = list(pending.values())
+
+        cache = self._options['cache_dir']
+        decode_cache = DecodeCache(cache) if cache is not None else None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda filename: _read_and_decode(filename, decode_cache), pending))
+
+        # 内容が同じ画像は、読み込み済みのページか今回最初に現れた画像と共有する
+        decoded_images = {}
+        digests = {}
+        first_of = {}  # 今回読み込む画像の内容のハッシュから、最初のファイル名を引く辞書
+        for filename, (digest, decoded) in zip(pending, results):
+            digests[filename] = digest
+            if digest not in first_of and self._find_content(digest) is None:
+                first_of[digest] = filename
+                decoded_images[filename] = decoded
+
+        # 振り分け先の候補になる既存のページ (状態を変える前に、収まるかどうかを確かめる)
+        capacity = MAX_COLORS - len(self.palette)
+        names = [name for name in self.pages if name.startswith(prefix) and name[len(prefix):].isdigit()]
+        existing = []
+        for name in names:
+            manager = self.pages[name]
+            existing.append((set(manager._color_slots) - set(self.palette), set(manager._key_slots),
+                             capacity - manager._free_capacity()))
+        plan = self.plan_pages(decoded_images, self.palette, existing=existing)
+
+        number = 0
+        touched = set()
+        for index, group in enumerate(plan):
+            if not group:
+                continue
+            if index < len(names):
+                name = names[index]
+            else:
+                while f"{prefix}{number}" in self.pages:
+                    number += 1
+                name = f"{prefix}{number}"
+            manager = self.page(name)
+            for filename in group:
+                decoded = decoded_images[filename]
+                color_map = manager._allocate_colors(filename, decoded.palette, decoded.has_transparency)
+                manager._add_resource(filename, decoded, color_map, digests[filename])
+                self._page_of[filename] = name
+            touched.add(name)
+
+        loaded = {}
+        for filename in filenames:
+            name = self._find_page(filename)
+            if name is None:
+                # 内容が同じ画像を読み込んだページに対応付ける
+                name = self._find_content(digests[filename])
+                self.pages[name]._share_content(filename, digests[filename])
+            manager = self.pages[name]
+            if filename in decoded_images:
+                resource = manager.images[filename]
+            else:
+                resource = manager._acquire(filename)
+            loaded[filename] = (name, resource)
+            self._page_of[filename] = name
+        for name in touched:
+            self._commit(name)
+        return loaded
+
+    def _find_page(self, filename):
+        """
+        画像を読み込み済みのページ名を返す。別のパスで同じファイルを読み込んだ場合も見つかる。
+
+        Args:
+            filename (str): 画像ファイル名
+
+        Returns:
+            str: ページ名。どのページにも読み込まれていない場合はNone
+        """
+        for name, manager in self.pages.items():
+            if manager._resolve(filename) is not None:
+                return name
+        return None
+
+    def _find_content(self, digest):
+        """
+        内容が同じ画像を読み込み済みのページ名を返す。
+
+        Args:
+            digest (bytes): 画像ファイルの内容のハッシュ
+
+        Returns:
+            str: ページ名。どのページにも読み込まれていない場合はNone
+        """
+        for name, manager in self.pages.items():
+            if digest in manager._contents:
+                return name
+        return None
+
+    def switch(self, name):
+        """
+        Pyxelのパレットを指定したページのパレットに置き換える。
+
+        Args:
+            name (str): ページ名
+
+        Raises:
+            KeyError: ページがない場合
+        """
+        manager = self.pages[name]
+        pyxel.colors.from_list(manager.combined_palette)
+        manager._dirty = False
+        self.current = name
+
+    def _commit(self, name):
+        """
+        ページのパレットの変更を確定する。現在のページであればPyxelに適用し、
+        それ以外のページは切り替えたときに適用されるため、適用済みとして扱う。
+
+        Args:
+            name (str): ページ名
+        """
+        manager = self.pages[name]
+        if name == self.current:
+            manager.apply_palette_to_pyxel()
+        else:
+            manager._dirty = False
+
+    @staticmethod
+    def plan_pages(decoded_images, palette, max_colors=MAX_COLORS, existing=None):
+        """
+        画像をできるだけ少ないページに振り分ける静的メソッド。
+        色数の多い画像から順に、新しく増える色が最も少なくなるページに入れ (最良適合減少法)、
+        どのページにも収まらない場合は新しいページを作る。
+
+        Args:
+            decoded_images (dict): 画像ファイル名からDecodedImageを引く辞書
+            palette (list): 各ページのパレットの最初の色
+            max_colors (int): 1ページのパレットの上限
+            existing (list): 画像を追加できる既存のページの (不透明色の集合, 透過色の集合, 使用中の色数) のリスト。
+                色の集合にはpaletteの色を含めない
+
+        Returns:
+            list: ページごとの画像ファイル名のリスト (各ページ内はdecoded_imagesの順)。
+                existingを指定した場合は、先頭のlen(existing)個が既存のページに追加する画像 (空の場合もある)
+
+        Raises:
+            ValueError: 1枚だけでページのパレットの上限を超える画像がある場合
+        """
+        capacity = max_colors - len(palette)
+        base_colors = set(palette)
+        order = {filename: i for i, filename in enumerate(decoded_images)}
+
+        # 画像ごとに、最初の色以外で必要になる不透明色と透過色を求める
+        needs = []
+        for filename, decoded in decoded_images.items():
+            colors = decoded.palette[1:] if decoded.has_transparency else decoded.palette
+            opaque = set(colors) - base_colors
+            keys = {decoded.palette[0]} if decoded.has_transparency else set()
+            if len(opaque) + len(keys) > capacity:
+                raise ValueError(f"{filename} は1枚だけでパレットの上限{max_colors}色を超えてしまいます")
+            needs.append((filename, opaque, keys))
+        needs.sort(key=lambda need: len(need[1]) + len(need[2]), reverse=True)
+
+        # [画像ファイル名のリスト, 不透明色の集合, 透過色の集合, 使用中の色数]
+        pages = [[[], set(opaque), set(keys), used] for opaque, keys, used in (existing or [])]
+        for filename, opaque, keys in needs:
+            best = None
+            best_added = None
+            for page in pages:
+                added = len(opaque - page[1]) + len(keys - page[2])
+                if page[3] + added <= capacity and (best is None or added < best_added):
+                    best = page
+                    best_added = added
+            if best is None:
+                best = [[], set(), set(), 0]
+                best_added = len(opaque) + len(keys)
+                pages.append(best)
+            best[0].append(filename)
+            best[1].update(opaque)
+            best[2].update(keys)
+            best[3] += best_added
+        return [sorted(page[0], key=order.get) for page in pages]
+
+class StreamingLoader:
+    """
+    pyxel.runの実行中に、フレームを落とさずに画像を読み込むクラス。
+    デコードはバックグラウンドのスレッドで行い、毎フレームのupdateで指定した時間の範囲内だけ
+    デコード済みの画像をImageManagerに取り込みます。取り込みはメインスレッドで要求順に行うため、
+    パレットの割り当てはload_imagesと同じ結果になります。
+    """
+    def __init__(self, manager, budget_ms=2.0, max_workers=None):
+        """
+        StreamingLoaderのコンストラクタ。
+
+        Args:
+            manager (ImageManager): 画像を取り込むImageManager
+            budget_ms (float): 1回のupdateで画像の取り込みに使う時間の上限 (ミリ秒)
+            max_workers (int): デコードに使うスレッド数。省略した場合はプールの既定値
+        """
+        self.manager = manager
+        self.budget_ms = budget_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._queue = []  # (ファイル名, Future, コールバック) のリスト (要求順)
+        self._decoding = {}  # 正規化したファイルパスから、取り込み待ちのデコードのFutureを引く辞書
+        self.errors = []  # 読み込みに失敗した (ファイル名, エラーメッセージ) のリスト
+
+    @property
+    def pending(self):
+        """まだ取り込まれていない画像の数。"""
+        return len(self._queue)
+
+    def request(self, filenames, callback=None):
+        """
+        画像の読み込みを要求する。デコードはすぐにバックグラウンドで始まる。
+
+        Args:
+            filenames (list): 画像ファイル名のリスト
+            callback (callable): 画像を取り込んだときに (ファイル名, PyxelImageResource) を引数に呼ばれる関数
+        """
+        manager = self.manager
+        timed = manager._profile is not None
+        for filename in filenames:
+            future = None
+            if manager._resolve(filename) is None:
+                # 同じファイルを指すパスのデコードが取り込み待ちであれば、そのFutureを共有する
+                path = _normalize_path(filename)
+                future = self._decoding.get(path)
+                if future is None:
+                    future = self._executor.submit(_read_and_decode, filename, manager.decode_cache, timed)
+                    self._decoding[path] = future
+            self._queue.append((filename, future, callback))
+
+    def update(self):
+        """
+        デコードが終わった画像を、時間の上限まで要求順に取り込む。毎フレーム呼び出す。
+        パレットは取り込みの最後に1回だけPyxelに適用するため、取り込み途中の色が表示されることはない。
+
+        Returns:
+            int: 取り込んだ画像の数
+        """
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        count = 0
+        while self._queue:
+            filename, future, callback = self._queue[0]
+            # 要求順に取り込むため、先頭のデコードが終わっていなければ次のフレームに回す
+            if future is not None and not future.done():
+                break
+            self._queue.pop(0)
+            if future is not None and self._decoding.get(_normalize_path(filename)) is future:
+                del self._decoding[_normalize_path(filename)]
+            resource = self._integrate(filename, future)
+            if resource is not None and callback is not None:
+                callback(filename, resource)
+            count += 1
+            if time.perf_counter() >= deadline:
+                break
+
+        if count:
+            self.manager.apply_palette_to_pyxel()
+        return count
+
+    def _integrate(self, filename, future):
+        """
+        デコード済みの画像をImageManagerに取り込む。
+
+        Args:
+            filename (str): 画像ファイル名
+            future (Future): デコード結果を持つFuture。要求時に読み込み済みだった場合はNone
+
+        Returns:
+            PyxelImageResource: 取り込んだ画像リソース。失敗した場合はNone
+        """
+        manager = self.manager
+        if manager._resolve(filename) is not None:
+            return manager._acquire(filename)
+        try:
+            if future is not None:
+                digest, decoded = future.result()
+            else:
+                digest, decoded = _read_and_decode(filename, manager.decode_cache, manager._profile is not None)
+            if manager._share_content(filename, digest):
+                return manager._acquire(filename)
+            color_map = manager._allocate_colors(filename, decoded.palette, decoded.has_transparency)
+        except ValueError as e:
+            self.errors.append((filename, str(e)))
+            return None
+        return manager._add_resource(filename, decoded, color_map, digest)
+
+    def shutdown(self):
+        """バックグラウンドのスレッドを終了する。取り込まれていない画像は破棄される。"""
+        for _, future, _ in self._queue:
+            if future is not None:
+                future.cancel()
+        self._queue = []
+        self._decoding = {}
+        self._executor.shutdown(wait=False)
+
+class AssetManifest:
+    """
+    フォルダ内の画像を、含めるファイルと除外するファイルの規則に従って読み込むクラス。
+    読み込んだ後は、変更されたファイルだけを読み込み直すことができます (ホットリロード)。
+    """
+    def __init__(self, manager, directory, include=('*.png',), exclude=('_*',), recursive=False):
+        """
+        AssetManifestのコンストラクタ。
+
+        Args:
+            manager (ImageManager): 画像を読み込むImageManager
+            directory (str): 画像ファイルのフォルダ
+            include (list): 読み込むファイルのパターンのリスト ('*'などのワイルドカードが使える)
+            exclude (list): 除外するファイルのパターンのリスト。既定ではファイル名が'_'で始まるものを除外する
+            recursive (bool): Trueの場合はサブフォルダの画像も対象にする
+
+        パターンに'/'が含まれる場合はフォルダからの相対パスと、含まれない場合はファイル名と照合する。
+        """
+        self.manager = manager
+        self.directory = directory
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.recursive = recursive
+        self.resources = {}  # 画像ファイル名から画像リソースを引く辞書 (読み込んだ順)
+        self._state = {}  # 画像ファイル名から (サイズ, 更新時刻, 内容のハッシュ) を引く辞書
+        self._failed = {}  # 読み込みに失敗した画像ファイル名から (サイズ, 更新時刻) を引く辞書
+
+    @classmethod
+    def from_file(cls, manager, filename):
+        """
+        JSON形式のマニフェストファイルからAssetManifestを作成するクラスメソッド。
+        ファイルには "directory" (マニフェストファイルからの相対パス)、"include"、"exclude"、"recursive" を書く。
+
+        Args:
+            manager (ImageManager): 画像を読み込むImageManager
+            filename (str): マニフェストファイルのパス
+
+        Returns:
+            AssetManifest: 作成したAssetManifest
+        """
+        with open(filename, encoding='utf-8') as f:
+            manifest = json.load(f)
+        directory = os.path.join(os.path.dirname(filename), manifest.get('directory', '.'))
+        return cls(manager, directory, manifest.get('include', ('*.png',)), manifest.get('exclude', ('_*',)),
+                   manifest.get('recursive', False))
+
+    def scan(self):
+        """
+        規則に一致する画像ファイルを名前順に返す。
+
+        Returns:
+            list: 画像ファイル名のリスト
+        """
+        filenames = []
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            for name in sorted(files):
+                filename = os.path.join(root, name)
+                if self._matches(os.path.relpath(filename, self.directory).replace(os.sep, '/')):
+                    filenames.append(filename)
+            if not self.recursive:
+                break
+        return filenames
+
+    def _matches(self, path):
+        """
+        フォルダからの相対パスが、含めるパターンのいずれかに一致し、除外するパターンのどれにも一致しないか調べる。
+
+        Args:
+            path (str): '/'区切りの相対パス
+
+        Returns:
+            bool: 対象のファイルであればTrue
+        """
+        name = path.rsplit('/', 1)[-1]
+
+        def match(pattern):
+            return fnmatch.fnmatchcase(path if '/' in pattern else name, pattern)
+
+        return any(match(pattern) for pattern in self.include) and not any(match(pattern) for pattern in self.exclude)
+
+    def load(self, skip_errors=False, quantize=False):
+        """
+        規則に一致する画像をすべて読み込む。
+
+        Args:
+            skip_errors (bool): Trueの場合は読み込みに失敗した画像を警告を出して飛ばす
+            quantize (bool): Trueの場合はload_images_quantizedで読み込む (パレットの上限を超える場合は減色する)
+
+        Returns:
+            list: 読み込んだ画像リソースのリスト
+        """
+        filenames = self.scan()
+        if quantize:
+            resources = self.manager.load_images_quantized(filenames)
+        else:
+            resources = self.manager.load_images(filenames, skip_errors=skip_errors)
+        # 内容が同じため別のファイルと共有している画像リソースも、ファイルごとに記録する
+        for filename in filenames:
+            key = self.manager._resolve(filename)
+            if key is not None:
+                self._track(filename, self.manager.images[key])
+            else:
+                self._fail(filename)
+        return resources
+
+    def refresh(self):
+        """
+        フォルダを調べ直し、追加・変更・削除されたファイルだけを読み込み直す。
+        サイズと更新時刻が変わっていないファイルは読み込まず、変わっていても内容が同じであれば読み込み直さない。
+        何か変更した場合は、最後にパレットをPyxelに適用する。
+
+        Returns:
+            dict: 'added'、'changed'、'removed' (それぞれ画像ファイル名のリスト) と、
+                'errors' (読み込みに失敗した (画像ファイル名, エラーメッセージ) のリスト) を持つ辞書
+        """
+        changes = {'added': [], 'changed': [], 'removed': [], 'errors': []}
+        current = self.scan()
+        for filename in set(self.resources) - set(current):
+            self.manager.unload(self.resources.pop(filename))
+            del self._state[filename]
+            changes['removed'].append(filename)
+
+        for filename in current:
+            try:
+                if filename not in self.resources:
+                    # 読み込みに失敗したファイルは、変更されるまで読み込み直さない
+                    if filename in self._failed and not self._stat_changed(filename, self._failed[filename]):
+                        continue
+                    self._track(filename, self.manager.load_image(filename))
+                    self._failed.pop(filename, None)
+                    changes['added'].append(filename)
+                elif self._changed(filename):
+                    resource = self.manager.reload(filename)
+                    self._track(filename, resource)
+                    changes['changed'].append(filename)
+                    # 内容が同じだったため画像リソースを共有していた別のファイルは、自分の内容で読み込み直す
+                    for other in [other for other, shared in self.resources.items()
+                                  if shared is resource and other != filename]:
+                        self.manager.unload(resource)
+                        self._track(other, self.manager.load_image(other))
+            except (OSError, ValueError) as e:
+                self._fail(filename)
+                changes['errors'].append((filename, str(e)))
+
+        if changes['added'] or changes['changed'] or changes['removed']:
+            self.manager.apply_palette_to_pyxel()
+        return changes
+
+    def _track(self, filename, resource):
+        """
+        画像リソースと、変更を検出するためのファイルの状態を記録する。
+
+        Args:
+            filename (str): 画像ファイル名
+            resource (PyxelImageResource): 画像リソース
+        """
+        stat = os.stat(filename)
+        # ImageManagerが読み込み時に求めた内容のハッシュがあれば、ファイルを読み直さずに使う
+        digest = resource._digest
+        if digest is None:
+            with open(filename, 'rb') as f:
+                digest = hashlib.sha1(f.read()).digest()
+        self.resources[filename] = resource
+        self._state[filename] = (stat.st_size, stat.st_mtime_ns, digest)
+
+    def _fail(self, filename):
+        """
+        読み込みに失敗したファイルの状態を記録する。
+
+        Args:
+            filename (str): 画像ファイル名
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return
+        self._failed[filename] = (stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def _stat_changed(filename, state):
+        """
+        ファイルのサイズと更新時刻が、記録した状態から変わったか調べる静的メソッド。
+
+        Args:
+            filename (str): 画像ファイル名
+            state (tuple): 記録した (サイズ, 更新時刻)
+
+        Returns:
+            bool: 変わった場合はTrue
+        """
+        stat = os.stat(filename)
+        return (stat.st_size, stat.st_mtime_ns) != state
+
+    def _changed(self, filename):
+        """
+        ファイルが前回の記録から変更されたか調べる。
+        サイズと更新時刻が同じであれば内容は読まず、更新時刻だけが変わった場合は記録を更新する。
+
+        Args:
+            filename (str): 画像ファイル名
+
+        Returns:
+            bool: 内容が変更された場合はTrue
+        """
+        size, mtime_ns, digest = self._state[filename]
+        if not self._stat_changed(filename, (size, mtime_ns)):
+            return False
+        stat = os.stat(filename)
+        with open(filename, 'rb') as f:
+            new_digest = hashlib.sha1(f.read()).digest()
+        if new_digest == digest:
+            self._state[filename] = (stat.st_size, stat.st_mtime_ns, digest)
+            return False
+        return True
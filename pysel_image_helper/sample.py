@@ -3,9 +3,10 @@
 # desc: Pyxel Image Helperの機能を示すサンプルプログラム
 
 import pyxel
-import glob
-import os
-from pyxel_image_helper import ImageManager
+from pyxel_image_helper import ImageManager, SpriteBatch, AssetManifest
+
+# Trueにすると、パレットの上限255色を超える場合に減色してすべての画像を読み込む
+QUANTIZE = False
 
 class App:
     """アプリケーション本体のクラス"""
@@ -13,23 +14,24 @@ class App:
         """初期化処理"""
         pyxel.init(320, 320, title="Pyxel Image Helper Sample", fps=30)
 
-        # 描画する画像リソースのリスト
-        self.images_to_draw = []
+        # imgフォルダ内のpngファイルをすべて対象にする (ファイル名が'_'で始まるものはスキップ)
+        self.image_manager = ImageManager()
+        self.assets = AssetManifest(self.image_manager, 'img', include=['*.png'], exclude=['_*'])
         # ImageManagerを使用して画像を読み込む
-        with ImageManager() as image_manager:
-            # imgフォルダ内のpngファイルをすべて取得
-            png_files = sorted(glob.glob('img/*.png'))
-            for filename in png_files:
-                # ファイル名が'_'で始まるものはスキップ
-                if os.path.basename(filename).startswith('_'):
-                    continue
-                try:
-                    # 画像を読み込み、パレットを管理
-                    resource = image_manager.load_image(filename)
-                    self.images_to_draw.append(resource)
-                except ValueError as e:
-                    # パレット数の上限を超えるなどのエラーが発生した場合はスキップ
-                    print(f"エラーのためファイルをスキップします: {e}")
+        with self.image_manager:
+            if QUANTIZE:
+                # すべての画像を共有パレットで読み込み、減色による誤差を表示
+                self.assets.load(quantize=True)
+                print(f"減色による誤差 (RMSE): {self.image_manager.quantize_error:.2f}")
+            else:
+                # 画像を並列にデコードして読み込む
+                # パレット数の上限を超えるなどのエラーが発生した画像は警告を出してスキップ
+                self.assets.load(skip_errors=True)
+
+        # 画像を並べて描画するためのバッチ (配置は画像が変わるまで保持される)
+        self.batch = SpriteBatch()
+        self.batch.set_flow_layout(margin=4)
+        self.reset_batch()
 
         # 背景色のアニメーション関連の変数
         self.bg_color_index = 0  # 現在の背景色
@@ -39,12 +41,26 @@ class App:
 
         pyxel.run(self.update, self.draw)
 
+    def reset_batch(self):
+        """読み込んだ画像をすべてバッチに追加し直す"""
+        self.batch.clear()
+        for resource in self.assets.resources.values():
+            self.batch.add(resource)
+
     def update(self):
         """更新処理"""
         # Qキーでアプリケーションを終了
         if pyxel.btnp(pyxel.KEY_Q):
             pyxel.quit()
 
+        # 1秒ごとに画像ファイルの変更を調べ、追加・変更・削除された画像だけを読み込み直す
+        if pyxel.frame_count % 30 == 0:
+            changes = self.assets.refresh()
+            for filename, message in changes['errors']:
+                print(f"読み込めませんでした: {message}")
+            if changes['added'] or changes['changed'] or changes['removed']:
+                self.reset_batch()
+
         # 3秒ごと（90フレーム）に表示状態を更新
         self.bg_color_timer += 1
         if self.bg_color_timer >= 90:
@@ -74,26 +90,8 @@ class App:
         # 指定した色で画面をクリア
         pyxel.cls(self.bg_color_index)
 
-        # 画像を並べて描画するための変数
-        margin = 4  # 画像間のマージン
-        x, y = margin, margin
-        row_height = 0  # 現在の行の高さ
-        
-        for resource in self.images_to_draw:
-            # 画像が画面幅を超える場合は改行
-            if x + resource.image.width > pyxel.width - margin:
-                x = margin
-                y += row_height + margin
-                row_height = 0
-
-            # 画像を描画
-            resource.draw(x, y, transparency_enabled=self.transparency_enabled)
-            
-            # 次の画像の描画位置を更新
-            x += resource.image.width + margin
-            # 現在の行で最も高い画像の高さを保持
-            if resource.image.height > row_height:
-                row_height = resource.image.height
+        # 画像を並べて描画
+        self.batch.draw(transparency_enabled=self.transparency_enabled)
 
 if __name__ == "__main__":
     App()